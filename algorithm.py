@@ -1,11 +1,6 @@
 import dataset
 from abc import ABC, abstractmethod
-from enum import Enum
-
-
-class Baseline(Enum):
-    POPULATION = 1
-    COMPLEMENT = 2
+from rule import Baseline
 
 
 class Algorithm(ABC):
@@ -14,7 +9,7 @@ class Algorithm(ABC):
     def __init__(self, dataset: dataset.Dataset,
                  baseline: Baseline, alpha: float) -> None:
         self._dataset: dataset.Dataset = dataset
-        self._baseline: baseline.Baseline = baseline
+        self._baseline: Baseline = baseline
         self._alpha: float = alpha
         self._rules: list = []
 
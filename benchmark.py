@@ -0,0 +1,529 @@
+import glob
+import json
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+
+from case_coverage import CaseCoverage
+import dataset
+import esmam
+import rule
+import runner
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datasets')
+SURVIVAL_NAME = 'survival_time'
+STATUS_NAME = 'survival_status'
+
+
+def dataset_paths() -> list:
+    """Return paths of every bundled dataset."""
+    return sorted(glob.glob(os.path.join(DATA_PATH, '*.xz')))
+
+
+def best_of(fn, repeat: int = 5) -> float:
+    """Return the best wall time, in seconds, of repeat calls to fn."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_tx_array(repeat: int = 5) -> None:
+    """Compare row-wise and columnar construction of the packed tx matrix."""
+    print('{:<16}{:>8}{:>16}{:>16}{:>10}'.format(
+        'dataset', 'rows', 'row-wise r/s', 'columnar r/s', 'speedup'))
+    for path in dataset_paths():
+        ds = dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME)
+        with open(path.split('.')[0] + '_dtypes.json', 'r') as f:
+            df = pd.read_csv(path, dtype=json.load(f))
+
+        def row_wise():
+            return np.stack(df.apply(ds.tx_as_binary, axis=1).values, axis=0)
+
+        assert np.array_equal(row_wise(), ds.binary_tx)
+        t_row = best_of(row_wise, repeat)
+        t_col = best_of(ds.make_tx_array, repeat)
+        print('{:<16}{:>8}{:>16.0f}{:>16.0f}{:>9.1f}x'.format(
+            os.path.basename(path).split('_')[0], ds.size,
+            ds.size / t_row, ds.size / t_col, t_row / t_col))
+
+
+def horizontal_get_tx(ds: dataset.Dataset, items: set()) -> np.array:
+    """Return all tx covered by a set of items scanning the horizontal
+    binary matrix row by row.
+    """
+    mask = np.zeros(ds.get_number_of_items(), dtype=int)
+    mask.put(list(items), 1)
+
+    binary_mask = np.packbits(mask)
+    covered_tx = np.bitwise_and(binary_mask, ds.binary_tx)
+
+    return np.nonzero(
+        np.apply_along_axis(
+            lambda x: np.all(np.equal(x, binary_mask)), 1,
+            covered_tx))[0]
+
+
+def random_itemsets(ds: dataset.Dataset, n_sets: int, seed: int = 0) -> list:
+    """Draw itemsets of one to three items, at most one per attribute,
+    taken from randomly chosen tx so that covers are never empty.
+    """
+    generator = np.random.default_rng(seed)
+    itemsets = []
+    for tx in generator.integers(ds.size, size=n_sets):
+        items = ds.get_items(np.array([tx]))
+        size = generator.integers(1, min(3, len(items)) + 1)
+        itemsets.append(set(generator.choice(items, size, replace=False)))
+    return itemsets
+
+
+def bench_get_tx(n_sets: int = 200, repeat: int = 3) -> None:
+    """Compare cover queries on the horizontal matrix and on the vertical
+    item-bitmap index.
+    """
+    print('{:<16}{:>8}{:>8}{:>16}{:>16}{:>10}'.format(
+        'dataset', 'rows', 'items', 'horizontal q/s', 'vertical q/s',
+        'speedup'))
+    for path in dataset_paths():
+        ds = dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME)
+        itemsets = random_itemsets(ds, n_sets)
+
+        for items in itemsets:
+            assert np.array_equal(horizontal_get_tx(ds, items),
+                                  ds.get_tx(items))
+        t_hor = best_of(
+            lambda: [horizontal_get_tx(ds, items) for items in itemsets],
+            repeat)
+        t_ver = best_of(
+            lambda: [ds.get_tx(items) for items in itemsets], repeat)
+        print('{:<16}{:>8}{:>8}{:>16.0f}{:>16.0f}{:>9.1f}x'.format(
+            os.path.basename(path).split('_')[0], ds.size,
+            ds.get_number_of_items(), n_sets / t_hor, n_sets / t_ver,
+            t_hor / t_ver))
+
+
+def bench_cache(repeat: int = 5) -> None:
+    """Compare building a Dataset from the raw file and from its cache."""
+    print('{:<16}{:>12}{:>12}{:>10}'.format(
+        'dataset', 'parse ms', 'cached ms', 'speedup'))
+    for path in dataset_paths():
+        dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME, use_cache=True)
+        t_parse = best_of(
+            lambda: dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME),
+            repeat)
+        t_cache = best_of(
+            lambda: dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME,
+                                    use_cache=True), repeat)
+        print('{:<16}{:>12.2f}{:>12.2f}{:>9.1f}x'.format(
+            os.path.basename(path).split('_')[0], 1000 * t_parse,
+            1000 * t_cache, t_parse / t_cache))
+
+
+def peak_memory(fn) -> int:
+    """Return the peak traced memory, in bytes, allocated while calling fn."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def replicated_copy(path: str, factor: int, directory: str) -> str:
+    """Write path's data repeated factor times as a plain CSV file into
+    directory, along with its dtypes file, and return the new data path.
+    """
+    name = os.path.basename(path).split('.')[0]
+    with open(path.split('.')[0] + '_dtypes.json', 'r') as f:
+        dtypes = json.load(f)
+    df = pd.read_csv(path, dtype=dtypes)
+
+    copy_path = os.path.join(directory, name + '.csv')
+    pd.concat([df] * factor, ignore_index=True).to_csv(copy_path, index=False)
+    with open(os.path.join(directory, name + '_dtypes.json'), 'w') as f:
+        json.dump(dtypes, f)
+    return copy_path
+
+
+def bench_chunks(factor: int = 200, chunk_size: int = 10000) -> None:
+    """Compare peak memory of whole-file and chunked loading on bundled
+    datasets scaled up factor times.
+    """
+    print('{:<16}{:>10}{:>14}{:>14}'.format(
+        'dataset', 'rows', 'whole MiB', 'chunked MiB'))
+    with tempfile.TemporaryDirectory() as directory:
+        for path in dataset_paths():
+            copy_path = replicated_copy(path, factor, directory)
+            whole = peak_memory(
+                lambda: dataset.Dataset(copy_path, SURVIVAL_NAME, STATUS_NAME))
+            chunked = peak_memory(
+                lambda: dataset.Dataset(copy_path, SURVIVAL_NAME, STATUS_NAME,
+                                        chunk_size=chunk_size))
+            print('{:<16}{:>10}{:>14.1f}{:>14.1f}'.format(
+                os.path.basename(path).split('_')[0],
+                dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME).size * factor,
+                whole / 2 ** 20, chunked / 2 ** 20))
+
+def bench_memory() -> None:
+    """Print the memory report and target dtypes of every dataset."""
+    print('{:<16}{:>8}{:>12}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+        'dataset', 'rows', 'binary_tx', 'item_tx', 'survival', 'status',
+        'total', 'times'))
+    for path in dataset_paths():
+        ds = dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME)
+        report = ds.memory_report()
+        print('{:<16}{:>8}{:>12}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+            os.path.basename(path).split('_')[0], ds.size,
+            report['binary_tx'], report['item_tx'], report['survival'],
+            report['status'], report['total'], str(ds.survival.dtype)))
+
+
+def survdiff_population(ds: dataset.Dataset, cover: np.array) -> float:
+    """Return survdiff's p-value of cover against the population."""
+    group = np.concatenate((np.zeros(ds.size), np.ones(len(cover))))
+    time = np.concatenate((ds.survival, ds.survival[cover]))
+    status = np.concatenate((ds.status, ds.status[cover]))
+    return sm.duration.survdiff(time, status, group)[1]
+
+
+def survdiff_complement(ds: dataset.Dataset, cover: np.array) -> float:
+    """Return survdiff's p-value of cover against its complement."""
+    group = np.zeros(ds.size)
+    np.put(group, cover, 1)
+    return sm.duration.survdiff(ds.survival, ds.status, group)[1]
+
+
+def bench_logrank(n_sets: int = 200, repeat: int = 3) -> None:
+    """Check LogRank against survdiff on random covers and compare speed."""
+    print('{:<16}{:>12}{:>12}{:>12}{:>10}'.format(
+        'dataset', 'max |dp|', 'survdiff/s', 'logrank/s', 'speedup'))
+    for path in dataset_paths():
+        ds = dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME)
+        covers = [ds.get_tx(items) for items in random_itemsets(ds, n_sets)]
+        covers = [cover for cover in covers if len(cover) < ds.size]
+        tests = ((survdiff_population, ds.logrank.population_test),
+                 (survdiff_complement, ds.logrank.complement_test))
+
+        error = max(abs(reference(ds, cover) - test(cover)[1])
+                    for reference, test in tests for cover in covers)
+        assert error < 1e-10, error
+        t_ref = best_of(lambda: [reference(ds, cover)
+                                 for reference, _ in tests
+                                 for cover in covers], repeat)
+        t_new = best_of(lambda: [test(cover)
+                                 for _, test in tests
+                                 for cover in covers], repeat)
+        n_tests = 2 * len(covers)
+        print('{:<16}{:>12.1e}{:>12.0f}{:>12.0f}{:>9.1f}x'.format(
+            os.path.basename(path).split('_')[0], error,
+            n_tests / t_ref, n_tests / t_new, t_ref / t_new))
+
+
+def bench_batch_quality(n_sets: int = 200, repeat: int = 3) -> None:
+    """Compare scoring candidate covers one by one and in a single batch."""
+    print('{:<16}{:>14}{:>14}{:>10}'.format(
+        'dataset', 'single c/s', 'batch c/s', 'speedup'))
+    for path in dataset_paths():
+        ds = dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME)
+        itemsets = random_itemsets(ds, n_sets)
+        covers = ds.get_tx_bitmaps(itemsets)
+        tests = ((rule.Baseline.POPULATION, ds.logrank.population_test),
+                 (rule.Baseline.COMPLEMENT, ds.logrank.complement_test))
+
+        for baseline, test in tests:
+            single = [1 - test(ds.get_tx(items))[1] for items in itemsets]
+            batch = rule.Rule.batch_quality(ds, baseline, covers)
+            assert np.allclose(single, batch, rtol=0, atol=1e-10)
+        t_single = best_of(lambda: [test(ds.get_tx(items))
+                                    for _, test in tests
+                                    for items in itemsets], repeat)
+        t_batch = best_of(lambda: [rule.Rule.batch_quality(ds, baseline,
+                                                           covers)
+                                   for baseline, _ in tests], repeat)
+        print('{:<16}{:>14.0f}{:>14.0f}{:>9.1f}x'.format(
+            os.path.basename(path).split('_')[0], 2 * n_sets / t_single,
+            2 * n_sets / t_batch, t_single / t_batch))
+
+
+def bench_quality_cache(n_colonies: int = 10, n_ants: int = 100,
+                        seed: int = 0) -> None:
+    """Report quality cache counters on an ant-like workload: every ant
+    draws up to three items, one per attribute, from a preference that
+    sharpens along the colony, and its rule and all one-item removals are
+    scored, as construction and pruning do.
+    """
+    print('{:<16}{:>10}{:>10}{:>10}{:>10}'.format(
+        'dataset', 'hits', 'misses', 'evictions', 'hit rate'))
+    for path in dataset_paths():
+        ds = dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME)
+        generator = np.random.default_rng(seed)
+        attributes = np.array([attribute for attribute, _ in ds.items_list])
+        n_items = ds.get_number_of_items()
+
+        for _ in range(n_colonies):
+            preference = generator.random(n_items)
+            for ant in range(n_ants):
+                weights = preference ** (1 + ant / 10)
+                items = set()
+                for _ in range(3):
+                    item = generator.choice(n_items, p=weights / weights.sum())
+                    items.add(item)
+                    weights[attributes == attributes[item]] = 0
+                    if not weights.any():
+                        break
+                for antecedent in [items] + [items - {i} for i in items]:
+                    candidate = rule.Rule(ds, rule.Baseline.COMPLEMENT)
+                    candidate.antecedent = antecedent
+                    candidate.quality()
+
+        stats = ds.quality_cache(rule.Baseline.COMPLEMENT).stats()
+        print('{:<16}{:>10}{:>10}{:>10}{:>10.2f}'.format(
+            os.path.basename(path).split('_')[0], stats['hits'],
+            stats['misses'], stats['evictions'], stats['hit_rate']))
+
+
+def bench_incremental_cover(n_rules: int = 200, repeat: int = 3) -> None:
+    """Compare maintaining covers while items are added one at a time with
+    recomputing them from the dataset after every addition.
+    """
+    print('{:<16}{:>16}{:>16}{:>10}'.format(
+        'dataset', 'recompute r/s', 'incremental r/s', 'speedup'))
+    for path in dataset_paths():
+        ds = dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME)
+        itemsets = [sorted(items) for items in random_itemsets(ds, n_rules)]
+
+        def construct(incremental):
+            for items in itemsets:
+                candidate = rule.Rule(ds, rule.Baseline.COMPLEMENT)
+                for item in items:
+                    candidate.add_item(item)
+                    if not incremental:
+                        candidate.set_cover()
+                    candidate.get_cover()
+
+        t_recompute = best_of(lambda: construct(False), repeat)
+        t_incremental = best_of(lambda: construct(True), repeat)
+        print('{:<16}{:>16.0f}{:>16.0f}{:>9.1f}x'.format(
+            os.path.basename(path).split('_')[0], n_rules / t_recompute,
+            n_rules / t_incremental, t_recompute / t_incremental))
+
+
+def item_heuristic(ds: dataset.Dataset, item: int, min_cover: float) -> float:
+    """Return the heuristic value of an item computed on its own."""
+    survival = ds.survival
+    avg_survival = survival.mean(dtype=np.float64)
+    tx = ds.get_tx({item})
+    n_tx = len(tx)
+    if n_tx < min_cover:
+        return 0
+    tx_above_avg = np.sum(survival[tx] >= avg_survival)
+    entropy = 0
+    for prob in (tx_above_avg / n_tx, (n_tx - tx_above_avg) / n_tx):
+        if prob != 0:
+            entropy -= prob * np.log2(prob)
+    return 1 - entropy
+
+
+def bench_heuristic(repeat: int = 3) -> None:
+    """Compare item-by-item and vectorized heuristic tables."""
+    print('{:<16}{:>8}{:>14}{:>14}{:>10}'.format(
+        'dataset', 'items', 'per-item ms', 'vector ms', 'speedup'))
+    for path in dataset_paths():
+        ds = dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME)
+        min_cover = 0.05 * ds.size
+        algorithm = esmam.Esmam(ds, esmam.Baseline.COMPLEMENT, 0.05, 100,
+                                10, 5, 0.05)
+
+        def per_item():
+            return np.array([item_heuristic(ds, item, min_cover)
+                             for item in range(ds.get_number_of_items())])
+
+        algorithm._heuristic_map()
+        assert np.allclose(per_item(), algorithm.heuristic,
+                           rtol=0, atol=1e-12)
+        t_item = best_of(per_item, repeat)
+        t_vector = best_of(algorithm._heuristic_map, repeat)
+        print('{:<16}{:>8}{:>14.2f}{:>14.2f}{:>9.1f}x'.format(
+            os.path.basename(path).split('_')[0], ds.get_number_of_items(),
+            1000 * t_item, 1000 * t_vector, t_item / t_vector))
+
+
+def bench_term_selection(n_draws: int = 500, repeat: int = 3) -> None:
+    """Compare drawing an ant's next item from a Python list of
+    probabilities with the array-based roulette wheel.
+    """
+    print('{:<16}{:>8}{:>12}{:>12}{:>10}'.format(
+        'dataset', 'items', 'list d/s', 'array d/s', 'speedup'))
+    for path in dataset_paths():
+        ds = dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME)
+        algorithm = esmam.Esmam(ds, rule.Baseline.COMPLEMENT, 0.05, 100,
+                                10, 5, 0.05)
+        algorithm._search_init()
+        generator = np.random.default_rng(0)
+        current_rule = rule.Rule(ds, rule.Baseline.COMPLEMENT)
+        current_rule.add_item(0)
+        available = np.ones(ds.get_number_of_items(), dtype=bool)
+        available[ds.item_attributes == ds.item_attributes[0]] = False
+
+        def list_draws():
+            for _ in range(n_draws):
+                present = set(ds.get_items(current_rule.get_cover()))
+                probabilities = []
+                for item in range(ds.get_number_of_items()):
+                    if available[item] and item in present:
+                        probabilities.append(
+                            (algorithm.heuristic[item] *
+                             algorithm.pheromone[item], item))
+                accum = sum(prob for prob, _ in probabilities)
+                generator.choice(len(probabilities), size=1,
+                                 p=[prob / accum for prob, _ in probabilities])
+
+        def array_draws():
+            for _ in range(n_draws):
+                algorithm._sample_item(current_rule, available)
+
+        t_list = best_of(list_draws, repeat)
+        t_array = best_of(array_draws, repeat)
+        print('{:<16}{:>8}{:>12.0f}{:>12.0f}{:>9.1f}x'.format(
+            os.path.basename(path).split('_')[0], ds.get_number_of_items(),
+            n_draws / t_list, n_draws / t_array, t_list / t_array))
+
+
+def bench_parallel_colony(workers: tuple = (1, 2, 4), n_ants: int = 200,
+                          seed: int = 0) -> None:
+    """Report ESMAM run time over worker counts, checking that each
+    configuration gives the same rules when run twice.
+    """
+    print('{:<16}{:>8}{:>10}{:>8}{:>10}'.format(
+        'dataset', 'workers', 'seconds', 'rules', 'speedup'))
+    for path in dataset_paths():
+        ds = dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME)
+        sequential = None
+        for n_workers in workers:
+            def run():
+                algorithm = esmam.Esmam(
+                    ds, rule.Baseline.COMPLEMENT, 0.05, n_ants, 10, 5, 0.05,
+                    seed=seed, n_workers=n_workers)
+                algorithm.run()
+                return [sorted(r.antecedent) for r in algorithm.results()]
+
+            rules = run()
+            assert rules == run()
+            seconds = best_of(run, 1)
+            sequential = sequential or seconds
+            print('{:<16}{:>8}{:>10.2f}{:>8}{:>9.1f}x'.format(
+                os.path.basename(path).split('_')[0], n_workers, seconds,
+                len(rules), sequential / seconds))
+
+
+def bench_runner(workers: tuple = (1, 2, 4), n_seeds: int = 8) -> None:
+    """Report the wall time of a multi-seed sweep over worker counts,
+    checking that results do not depend on the number of workers.
+    """
+    params = {'baseline': rule.Baseline.COMPLEMENT, 'alpha': 0.05,
+              'n_ants': 200, 'max_uncovered_cases': 10,
+              'n_rules_converg': 5, 'min_cover_per_rule': 0.05}
+    print('{:<16}{:>8}{:>10}{:>14}{:>10}'.format(
+        'dataset', 'workers', 'seconds', 'max RSS MiB', 'speedup'))
+    for path in dataset_paths():
+        ds = dataset.Dataset(path, SURVIVAL_NAME, STATUS_NAME)
+        reference = None
+        sequential = None
+        for n_workers in workers:
+            start = time.perf_counter()
+            results = runner.run_seeds(ds, params, range(n_seeds), n_workers)
+            seconds = time.perf_counter() - start
+
+            rules = [result['rules'] for result in results]
+            reference = reference or rules
+            assert rules == reference
+            sequential = sequential or seconds
+            print('{:<16}{:>8}{:>10.2f}{:>14.1f}{:>9.1f}x'.format(
+                os.path.basename(path).split('_')[0], n_workers, seconds,
+                max(result['peak_rss'] for result in results) / 2 ** 20,
+                sequential / seconds))
+
+
+def bench_shared(factor: int = 200, repeat: int = 3) -> None:
+    """Compare what a worker receives and how long it takes to rebuild the
+    Dataset, pickled whole and attached from shared memory, on bundled
+    datasets scaled up factor times.
+    """
+    print('{:<16}{:>10}{:>14}{:>14}{:>12}{:>12}'.format(
+        'dataset', 'rows', 'pickled KiB', 'handle KiB', 'unpickle ms',
+        'attach ms'))
+    with tempfile.TemporaryDirectory() as directory:
+        for path in dataset_paths():
+            ds = dataset.Dataset(replicated_copy(path, factor, directory),
+                                 SURVIVAL_NAME, STATUS_NAME)
+            pickled = pickle.dumps(ds)
+            ds.share()
+            try:
+                handle = pickle.dumps(ds)
+                t_pickled = best_of(lambda: pickle.loads(pickled), repeat)
+                t_handle = best_of(lambda: pickle.loads(handle), repeat)
+            finally:
+                ds.unshare()
+            print('{:<16}{:>10}{:>14.1f}{:>14.1f}{:>12.2f}{:>12.2f}'.format(
+                os.path.basename(path).split('_')[0], ds.size,
+                len(pickled) / 1024, len(handle) / 1024,
+                1000 * t_pickled, 1000 * t_handle))
+
+
+def bench_coverage(n_cases: int = 200000, n_rules: int = 200,
+                   repeat: int = 3) -> None:
+    """Compare uncovered-case updates through np.setdiff1d against the
+    CaseCoverage mask as rules of growing cover are added to a set.
+    """
+    rng = np.random.default_rng(0)
+    covers = [np.sort(rng.choice(n_cases, rng.integers(1, n_cases // 10),
+                                 replace=False)) for _ in range(n_rules)]
+
+    def with_setdiff():
+        uncovered = np.arange(n_cases)
+        for cover in covers:
+            uncovered = np.setdiff1d(uncovered, cover)
+            len(uncovered)
+        return uncovered
+
+    def with_mask():
+        coverage = CaseCoverage(n_cases)
+        for cover in covers:
+            coverage.add(cover)
+            coverage.n_uncovered
+        return coverage.uncovered_cases()
+
+    assert np.array_equal(with_setdiff(), with_mask())
+    t_setdiff = best_of(with_setdiff, repeat)
+    t_mask = best_of(with_mask, repeat)
+    print('{:<12}{:>10}{:>14}{:>12}{:>10}'.format(
+        'cases', 'rules', 'setdiff ms', 'mask ms', 'speedup'))
+    print('{:<12}{:>10}{:>14.2f}{:>12.2f}{:>10.1f}'.format(
+        n_cases, n_rules, 1000 * t_setdiff, 1000 * t_mask,
+        t_setdiff / t_mask))
+
+
+if __name__ == "__main__":
+    bench_tx_array()
+    bench_get_tx()
+    bench_cache()
+    bench_chunks()
+    bench_memory()
+    bench_logrank()
+    bench_batch_quality()
+    bench_quality_cache()
+    bench_incremental_cover()
+    bench_heuristic()
+    bench_term_selection()
+    bench_parallel_colony()
+    bench_runner()
+    bench_shared()
+    bench_coverage()
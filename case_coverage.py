@@ -0,0 +1,49 @@
+import numpy as np
+
+
+class CaseCoverage:
+    """Track how many rules of a rule set cover each case.
+    A case is covered while at least one rule covers it. The number of
+    uncovered cases is kept as a running tally.
+    """
+
+    def __init__(self, n_cases: int):
+        self.__count = np.zeros(n_cases, dtype=np.int32)
+        self.__covered = np.zeros(n_cases, dtype=bool)
+        self.__n_uncovered = n_cases
+
+    @property
+    def count(self) -> np.array:
+        return self.__count
+
+    @property
+    def covered(self) -> np.array:
+        return self.__covered
+
+    @property
+    def uncovered(self) -> np.array:
+        return ~self.__covered
+
+    @property
+    def n_uncovered(self) -> int:
+        return self.__n_uncovered
+
+    def uncovered_cases(self) -> np.array:
+        """Return the indices of uncovered cases."""
+        return np.flatnonzero(~self.__covered)
+
+    def add(self, cases: np.array) -> None:
+        """Account for a rule covering cases, given as unique indices."""
+        self.__n_uncovered -= int(np.count_nonzero(self.__count[cases] == 0))
+        self.__count[cases] += 1
+        self.__covered[cases] = True
+
+    def remove(self, cases: np.array) -> None:
+        """Account for a rule covering cases, given as unique indices,
+        leaving the rule set. Counts never go below zero.
+        """
+        before = self.__count[cases]
+        after = np.maximum(before - 1, 0)
+        self.__count[cases] = after
+        self.__covered[cases] = after > 0
+        self.__n_uncovered += int(np.count_nonzero((before > 0) & (after == 0)))
@@ -1,9 +1,15 @@
+import hashlib
 import json as json
 import os
+import tempfile
+from multiprocessing import shared_memory
 
 import numpy as np
 import pandas as pd
 
+from logrank import LogRank
+from quality_cache import QualityCache
+
 
 class Dataset:
     """Take original data as a DataFrame and store data (except for target columns)
@@ -11,31 +17,158 @@ class Dataset:
     values (except for target attributes).
     """
 
-    def __init__(self, data_path: str, attr_survival_name: str, attr_event_name: str):
+    CACHE_VERSION = 2
+    CACHE_ARRAYS = ('binary_tx', 'item_tx', 'survival', 'status')
+    INDEX_BLOCK_BYTES = 1
+
+    def __init__(self, data_path: str, attr_survival_name: str,
+                 attr_event_name: str, use_cache: bool = False,
+                 chunk_size: int = None, shared: dict = None):
         self.__data_path = data_path
         self.__DataFrame = None
+        self.__survival = None
+        self.__status = None
         self.__item_map = {}
         self.items_list = []
         self.__binary_tx = []
+        self.__item_tx = []
         self.__surv_col_name = attr_survival_name
         self.__status_col_name = attr_event_name
         self.__attribute_columns = None
+        self.__attribute_base = {}
+        self.__item_attributes = None
+        self.__logrank = None
+        self.__quality_caches = {}
+        self.__quality_cache_budget = {}
+        self.__shared_handle = None
+        self.__shared_segments = []
+        self.__shared_owner = False
+
+        if shared is not None:
+            self.attach_shared(shared)
+            return
 
-        self.load_dataframe()
-        self.map_items()
-        self.make_tx_array()
+        if use_cache and self.load_cache():
+            return
+
+        if chunk_size:
+            self.load_chunks(chunk_size)
+        else:
+            self.load_dataframe()
+            self.map_items()
+            self.make_tx_array()
+        self.make_item_index()
+
+        if use_cache:
+            try:
+                self.save_cache()
+            except OSError:
+                # the cache is only an accelerator, the data is already loaded
+                pass
 
     @property
     def survival(self) -> np.array:
-        return self.__DataFrame[self.__surv_col_name].values
+        return self.__survival
 
     @property
     def status(self) -> np.array:
-        return self.__DataFrame[self.__status_col_name].values
+        return self.__status
 
     @property
     def size(self) -> int:
-        return len(self.__DataFrame)
+        return len(self.__survival)
+
+    @property
+    def shared_handle(self) -> dict:
+        return self.__shared_handle
+
+    @property
+    def item_attributes(self) -> np.array:
+        """Index, in the attribute columns, of the attribute of each item."""
+        if self.__item_attributes is None:
+            index = {attribute: i for i, attribute
+                     in enumerate(self.__attribute_columns)}
+            self.__item_attributes = np.array(
+                [index[attribute] for attribute, _ in self.items_list],
+                dtype=self.index_dtype(len(index)))
+        return self.__item_attributes
+
+    @property
+    def logrank(self) -> LogRank:
+        if self.__logrank is None:
+            self.__logrank = LogRank(self.__survival, self.__status)
+        return self.__logrank
+
+    def quality_cache(self, baseline) -> QualityCache:
+        """Return the cache of rule qualities against baseline."""
+        if baseline not in self.__quality_caches:
+            self.__quality_caches[baseline] = QualityCache(
+                **self.__quality_cache_budget)
+        return self.__quality_caches[baseline]
+
+    def configure_quality_cache(self, max_entries: int = 100000,
+                                max_bytes: int = None) -> None:
+        """Set the budget of the quality caches, dropping their entries."""
+        self.__quality_cache_budget = {'max_entries': max_entries,
+                                       'max_bytes': max_bytes}
+        self.__quality_caches = {}
+
+    def invalidate_quality_cache(self) -> None:
+        """Drop every cached rule quality. Must be called whenever
+        anything rule qualities depend on changes.
+        """
+        for cache in self.__quality_caches.values():
+            cache.clear()
+
+    @property
+    def tx_dtype(self) -> np.dtype:
+        return self.index_dtype(self.size)
+
+    @property
+    def item_dtype(self) -> np.dtype:
+        return self.index_dtype(len(self.__item_map))
+
+    @staticmethod
+    def index_dtype(n: int) -> np.dtype:
+        """Return the smallest unsigned integer type indexing n elements."""
+        if n <= 1 << 16:
+            return np.dtype(np.uint16)
+        if n <= 1 << 32:
+            return np.dtype(np.uint32)
+        return np.dtype(np.uint64)
+
+    @staticmethod
+    def compact_times(times: np.array) -> np.array:
+        """Return survival times as the narrowest float array holding
+        every time exactly.
+        """
+        times = np.asarray(times)
+        compact = times.astype(np.float32)
+        if not np.array_equal(compact, times):
+            compact = times.astype(np.float64)
+        return np.ascontiguousarray(compact)
+
+    @staticmethod
+    def compact_events(events: np.array) -> np.array:
+        """Return survival status as a contiguous bool array."""
+        return np.ascontiguousarray(events, dtype=bool)
+
+    def memory_report(self) -> dict:
+        """Return the number of bytes held by each array of the dataset."""
+        report = {'binary_tx': self.__binary_tx.nbytes,
+                  'item_tx': self.__item_tx.nbytes,
+                  'survival': self.__survival.nbytes,
+                  'status': self.__status.nbytes}
+        report['total'] = sum(report.values())
+        return report
+
+    @property
+    def binary_tx(self) -> np.array:
+        return self.__binary_tx
+
+    @property
+    def item_tx(self) -> np.array:
+        return self.__item_tx
 
     def load_dataframe(self) -> None:
         """Read data from data_path and store it into a pandas DataFrame.
@@ -43,18 +176,293 @@ class Dataset:
         with open(self.__data_path.split('.')[0] + '_dtypes.json', 'r') as f:
             dtypes = json.load(f)
         self.__DataFrame = pd.read_csv(self.__data_path, dtype=dtypes)
-        self.map_items()
+        self.__survival = self.compact_times(
+            self.__DataFrame[self.__surv_col_name].values)
+        self.__status = self.compact_events(
+            self.__DataFrame[self.__status_col_name].values)
+
+    @property
+    def cache_path(self) -> str:
+        return self.__data_path.split('.')[0] + '_cache'
+
+    def cache_key(self) -> str:
+        """Return a digest of everything the preprocessed data depends on:
+        the data file, its dtypes file and the target column names.
+        """
+        digest = hashlib.sha256()
+        for path in (self.__data_path,
+                     self.__data_path.split('.')[0] + '_dtypes.json'):
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        digest.update(self.__surv_col_name.encode())
+        digest.update(b'\0')
+        digest.update(self.__status_col_name.encode())
+        return digest.hexdigest()
+
+    def load_cache(self) -> bool:
+        """Memory-map preprocessed data from the cache directory.
+        Return False, leaving the object untouched, if there is no cache or
+        it was built from different inputs.
+        """
+        meta_path = os.path.join(self.cache_path, 'meta.json')
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if meta.get('version') != self.CACHE_VERSION or \
+                meta.get('key') != self.cache_key():
+            return False
+
+        try:
+            arrays = {name: np.load(
+                os.path.join(self.cache_path, name + '.npy'), mmap_mode='r')
+                for name in self.CACHE_ARRAYS}
+        except (OSError, ValueError):
+            return False
+
+        # NaN is stored as null, the only value JSON cannot hold
+        self.__set_items(meta['attribute_columns'], [
+            (attribute, np.nan if value is None else value)
+            for attribute, value in meta['items']])
+        self.__binary_tx = arrays['binary_tx']
+        self.__item_tx = arrays['item_tx']
+        self.__survival = arrays['survival']
+        self.__status = arrays['status']
+        return True
+
+    def __set_items(self, attribute_columns: list, items: list) -> None:
+        """Rebuild the item map from the list of (attribute, value) items
+        in mapped order.
+        """
+        self.__attribute_columns = list(attribute_columns)
+        self.__item_map = {}
+        self.items_list = []
+        self.__attribute_base = {}
+        for mapped_int, item_reference in enumerate(items):
+            item_reference = tuple(item_reference)
+            self.__attribute_base.setdefault(item_reference[0], mapped_int)
+            self.__item_map[item_reference] = mapped_int
+            self.items_list.append(item_reference)
+
+    def share(self) -> dict:
+        """Publish the arrays of the dataset into shared memory segments
+        and return a picklable handle from which other processes can
+        attach to them. The segments live until unshare is called.
+        Pickling a shared Dataset sends its handle instead of its arrays.
+        """
+        if self.__shared_handle is not None:
+            return self.__shared_handle
+
+        arrays = {'binary_tx': self.__binary_tx,
+                  'item_tx': self.__item_tx,
+                  'survival': self.__survival,
+                  'status': self.__status}
+        segments = {}
+        for name in self.CACHE_ARRAYS:
+            array = arrays[name]
+            segment = shared_memory.SharedMemory(
+                create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, dtype=array.dtype,
+                                buffer=segment.buf)
+            shared[...] = array
+            self.__shared_segments.append(segment)
+            segments[name] = (segment.name, array.shape, array.dtype.str)
+        self.__shared_owner = True
+
+        self.__shared_handle = {
+            'data_path': self.__data_path,
+            'survival_name': self.__surv_col_name,
+            'status_name': self.__status_col_name,
+            'attribute_columns': self.__attribute_columns,
+            'items': self.items_list,
+            'segments': segments}
+        return self.__shared_handle
+
+    def unshare(self) -> None:
+        """Release the shared memory segments published by share. Datasets
+        attached to them must not be used afterwards. An attached Dataset
+        only stops publishing its handle.
+        """
+        if self.__shared_owner:
+            for segment in self.__shared_segments:
+                segment.close()
+                segment.unlink()
+            self.__shared_segments = []
+            self.__shared_owner = False
+        self.__shared_handle = None
+
+    def attach_shared(self, handle: dict) -> None:
+        """Map the arrays published by another Dataset's share, without
+        copies. The attached arrays are read-only.
+        """
+        arrays = {}
+        for name, (segment_name, shape, dtype) in handle['segments'].items():
+            try:
+                # The owner unlinks the segments, attaching ones must not
+                # have them tracked for cleanup at exit
+                segment = shared_memory.SharedMemory(
+                    name=segment_name, track=False)
+            except TypeError:
+                segment = shared_memory.SharedMemory(name=segment_name)
+            self.__shared_segments.append(segment)
+            arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype),
+                                      buffer=segment.buf)
+            arrays[name].flags.writeable = False
+
+        self.__set_items(handle['attribute_columns'], handle['items'])
+        self.__binary_tx = arrays['binary_tx']
+        self.__item_tx = arrays['item_tx']
+        self.__survival = arrays['survival']
+        self.__status = arrays['status']
+        self.__shared_handle = handle
+
+    @classmethod
+    def attach(cls, handle: dict) -> 'Dataset':
+        """Return a read-only Dataset attached to a shared handle."""
+        return cls(handle['data_path'], handle['survival_name'],
+                   handle['status_name'], shared=handle)
+
+    def __reduce_ex__(self, protocol):
+        if self.__shared_handle is not None:
+            return (Dataset.attach, (self.__shared_handle,))
+        return super().__reduce_ex__(protocol)
+
+    def save_cache(self) -> None:
+        """Write preprocessed data to the cache directory.
+        Every file is written to a temporary file of its own and renamed into
+        place, so readers that still map a previous version and concurrent
+        writers are not affected. The metadata goes last, as it holds the key
+        that validates the whole cache.
+        """
+        os.makedirs(self.cache_path, exist_ok=True)
+
+        def replace(name, write):
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_path,
+                                            prefix=name, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    write(f)
+                os.replace(tmp_path, os.path.join(self.cache_path, name))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+        arrays = {'binary_tx': self.__binary_tx,
+                  'item_tx': self.__item_tx,
+                  'survival': self.__survival,
+                  'status': self.__status}
+        for name in self.CACHE_ARRAYS:
+            replace(name + '.npy',
+                    lambda f: np.save(f, np.ascontiguousarray(arrays[name])))
+
+        items = [[attribute, None if pd.isna(value) else
+                  value.item() if isinstance(value, np.generic) else value]
+                 for attribute, value in self.items_list]
+        meta = {'version': self.CACHE_VERSION,
+                'key': self.cache_key(),
+                'attribute_columns': self.__attribute_columns,
+                'items': items}
+        replace('meta.json', lambda f: f.write(json.dumps(meta).encode()))
+
+    def load_chunks(self, chunk_size: int) -> None:
+        """Read data from data_path chunk_size rows at a time.
+        The item map grows as new values appear and each chunk is kept only
+        as compact per-attribute codes, so no DataFrame outlives its chunk.
+        Once all values are known, items are numbered exactly as map_items
+        would and the binary matrix of tx is built from the codes.
+        """
+        with open(self.__data_path.split('.')[0] + '_dtypes.json', 'r') as f:
+            dtypes = json.load(f)
+
+        values = {}
+        value_codes = {}
+        chunk_codes = []
+        survival = []
+        status = []
+
+        for chunk in pd.read_csv(self.__data_path, dtype=dtypes,
+                                 chunksize=chunk_size):
+            if self.__attribute_columns is None:
+                self.__attribute_columns = list(chunk.columns)
+                self.__attribute_columns.remove(self.__surv_col_name)
+                self.__attribute_columns.remove(self.__status_col_name)
+                for attribute in self.__attribute_columns:
+                    values[attribute] = []
+                    value_codes[attribute] = {}
+
+            codes = {}
+            for attribute in self.__attribute_columns:
+                local_codes, uniques = pd.factorize(
+                    chunk[attribute], use_na_sentinel=False)
+                attribute_codes = value_codes[attribute]
+                lookup = []
+                for value in uniques:
+                    # NaN never compares equal to itself, so it gets a
+                    # proper key to be found again in later chunks
+                    key = None if pd.isna(value) else value
+                    if key not in attribute_codes:
+                        attribute_codes[key] = len(values[attribute])
+                        values[attribute].append(value)
+                    lookup.append(attribute_codes[key])
+                lookup = np.array(lookup, dtype=np.min_scalar_type(
+                    len(values[attribute])))
+                codes[attribute] = lookup[local_codes]
+            chunk_codes.append(codes)
+            survival.append(chunk[self.__surv_col_name].values)
+            status.append(chunk[self.__status_col_name].values)
+
+        self.__item_map = {}
+        self.items_list = []
+        self.__attribute_base = {}
+        mapped_int = 0
+        for attribute in self.__attribute_columns:
+            self.__attribute_base[attribute] = mapped_int
+            for value in values[attribute]:
+                item_reference = (attribute, value)
+                self.__item_map[item_reference] = mapped_int
+                self.items_list.append(item_reference)
+                mapped_int += 1
+
+        self.__survival = self.compact_times(np.concatenate(survival))
+        self.__status = self.compact_events(np.concatenate(status))
+        del survival, status
+
+        self.__binary_tx = np.zeros(
+            (len(self.__survival), (mapped_int + 7) // 8), dtype=np.uint8)
+        first_row = 0
+        while chunk_codes:
+            codes = chunk_codes.pop(0)
+            rows = slice(first_row, first_row + len(
+                codes[self.__attribute_columns[0]]))
+            for attribute, attribute_codes in codes.items():
+                self.set_item_bits(
+                    self.__binary_tx[rows],
+                    attribute_codes.astype(np.intp) +
+                    self.__attribute_base[attribute])
+            first_row = rows.stop
 
     def map_items(self) -> None:
-        """Map unique items from the dataset to a int vector"""
+        """Map unique items from the dataset to a int vector.
+        Items of an attribute are numbered consecutively, in order of first
+        appearance, starting at the attribute's base index.
+        """
         self.__attribute_columns = list(self.__DataFrame.columns)
         self.__attribute_columns.remove(self.__surv_col_name)
         self.__attribute_columns.remove(self.__status_col_name)
 
+        self.__item_map = {}
+        self.items_list = []
+        self.__attribute_base = {}
         mapped_int = 0
 
         for attribute in self.__attribute_columns:
-            for value in self.__DataFrame[attribute].unique():
+            self.__attribute_base[attribute] = mapped_int
+            _, values = pd.factorize(
+                self.__DataFrame[attribute], use_na_sentinel=False)
+            for value in values:
                 item_reference = (attribute, value)
                 self.__item_map[item_reference] = mapped_int
                 self.items_list.append(item_reference)
@@ -82,31 +490,91 @@ class Dataset:
 
     def make_tx_array(self) -> None:
         """Construct binary matrix of tx.
-        Shape is number of tx by the number of different items.
+        Shape is number of tx by the number of different items, packed
+        along the items axis. Each attribute column is turned into
+        categorical codes, offset by the attribute's base index and
+        scattered into the packed matrix for all tx at once.
         """
-        a = self.__DataFrame.apply(
-            self.tx_as_binary, axis=1)
+        n_tx = len(self.__DataFrame)
+        n_bytes = (len(self.__item_map) + 7) // 8
 
-        self.__binary_tx = np.stack(a.values, axis=0)
+        binary_tx = np.zeros((n_tx, n_bytes), dtype=np.uint8)
+        for attribute in self.__attribute_columns:
+            codes, _ = pd.factorize(
+                self.__DataFrame[attribute], use_na_sentinel=False)
+            self.set_item_bits(
+                binary_tx, codes + self.__attribute_base[attribute])
+
+        self.__binary_tx = binary_tx
+
+    @staticmethod
+    def set_item_bits(binary_tx: np.array, items: np.array) -> None:
+        """Set, in place, bit items[i] of packed row i of binary_tx."""
+        # Each tx holds exactly one item per attribute, so there are
+        # no repeated (row, byte) pairs within a single scatter.
+        binary_tx[np.arange(len(items)), items >> 3] |= np.right_shift(
+            0x80, items & 7).astype(np.uint8)
+
+    def make_item_index(self) -> None:
+        """Construct the vertical index of the binary matrix of tx.
+        Row i is the packed bitmap of tx containing item i, so its shape
+        is number of items by the number of tx (packed). The matrix is
+        transposed a few packed columns at a time to keep the unpacked
+        temporaries small.
+        """
+        n_items = len(self.__item_map)
+        item_tx = np.empty((n_items, (self.size + 7) // 8), dtype=np.uint8)
+        for first_byte in range(0, self.__binary_tx.shape[1],
+                                self.INDEX_BLOCK_BYTES):
+            block = self.__binary_tx[
+                :, first_byte:first_byte + self.INDEX_BLOCK_BYTES]
+            first_item = 8 * first_byte
+            last_item = min(n_items, first_item + 8 * block.shape[1])
+            incidence = np.unpackbits(
+                block, axis=1, count=last_item - first_item)
+            item_tx[first_item:last_item] = np.packbits(incidence.T, axis=1)
+        self.__item_tx = item_tx
+
+    def get_tx_bitmap(self, items: set()) -> np.array:
+        """Return the packed bitmap of all tx covered by a set of items."""
+        if not items:
+            return np.packbits(np.ones(self.size, dtype=np.uint8))
+        return np.bitwise_and.reduce(
+            self.__item_tx[list(items)], axis=0)
+
+    def get_tx_bitmaps(self, itemsets: list) -> np.array:
+        """Return the packed bitmaps of tx covered by each set of items,
+        one row per itemset.
+        """
+        bitmaps = np.empty((len(itemsets), (self.size + 7) // 8),
+                           dtype=np.uint8)
+        for row, items in enumerate(itemsets):
+            bitmaps[row] = self.get_tx_bitmap(items)
+        return bitmaps
 
     def get_tx(self, items: set()) -> np.array:
         """Return all tx covered by a set of items."""
-        mask = np.zeros(len(self.__item_map), dtype=int)
-        mask.put(list(items), 1)
+        return np.nonzero(np.unpackbits(
+            self.get_tx_bitmap(items), count=self.size))[0].astype(
+                self.tx_dtype)
 
-        binary_mask = np.packbits(mask)
-        covered_tx = np.bitwise_and(
-            binary_mask, self.__binary_tx)
+    def filter_tx(self, tx: np.array, item: int) -> np.array:
+        """Return the tx of tx that contain item, in their original order.
+        Only the bits of tx are read, so the cost is that of len(tx).
+        """
+        bitmap = self.__item_tx[item]
+        bits = bitmap[tx >> 3] >> (7 - (tx & 7)).astype(np.uint8)
+        return tx[(bits & 1).astype(bool)]
 
-        return np.nonzero(
-            np.apply_along_axis(
-                lambda x: np.all(np.equal(x, binary_mask)), 1,
-                covered_tx))[0]
+    def get_item_mask(self, tx: np.array) -> np.array:
+        """Get boolean mask of the items covered by a set of tx."""
+        return np.unpackbits(
+            np.bitwise_or.reduce(self.__binary_tx[tx]),
+            count=len(self.__item_map)).view(bool)
 
     def get_items(self, tx: np.array) -> np.array:
         """Get set of items covered by a set of tx."""
-        return np.nonzero(np.unpackbits(
-            np.bitwise_or.reduce(self.__binary_tx[tx])))[0]
+        return np.nonzero(self.get_item_mask(tx))[0].astype(self.item_dtype)
 
 
 if __name__ == "__main__":
@@ -1,16 +1,14 @@
 import math
 import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 
 from algorithm import Algorithm
+from case_coverage import CaseCoverage
 import dataset
 import rule
-from enum import Enum
-
-
-class Baseline(Enum):
-    POPULATION = 1
-    COMPLEMENT = 2
+from rule import Baseline
 
 
 class Esmam(Algorithm):
@@ -18,55 +16,80 @@ class Esmam(Algorithm):
 
     def __init__(self, dataset, baseline, alpha: float,
                  n_ants: int, max_uncovered_cases: int,
-                 n_rules_converg: int, min_cover_per_rule: float) -> None:
+                 n_rules_converg: int, min_cover_per_rule: float,
+                 seed: int = 0, n_workers: int = None) -> None:
 
         super().__init__(dataset, baseline, alpha)
         self.__n_ants: int = n_ants
         self.__max_uncovered_cases: int = max_uncovered_cases
         self.__n_rules_for_convergence: int = n_rules_converg
         self.__delta_uncovered: int = 0
-        self.__current_colony: int = 0
         self.__pheromone: np.array = None
         self.__heuristic: np.array = None
+        self.__min_cover_fraction: float = min_cover_per_rule
         self.__min_cover_per_rule: float = min_cover_per_rule * \
-            self._dataset.DataFrame.shape[0]
-        self.__uncovered_cases = np.arange(self._dataset.DataFrame.shape[0])
-        self.__available_items = np.ones(self._dataset.get_number_of_items())
+            self._dataset.size
+        self.__coverage = CaseCoverage(self._dataset.size)
+        self.__generator = np.random.default_rng(seed)
+        # Parallel colonies draw one random stream per ant from the seed
+        self.__seed_sequence = np.random.SeedSequence(seed)
+        self.__n_workers: int = n_workers
+        self.__pool: ProcessPoolExecutor = None
+        self.__shares_dataset: bool = False
+
+    @property
+    def heuristic(self) -> np.array:
+        return self.__heuristic
+
+    @property
+    def pheromone(self) -> np.array:
+        return self.__pheromone
+
+    @property
+    def coverage(self) -> CaseCoverage:
+        return self.__coverage
 
     def run(self) -> None:
         """Execute ESMAM Algorithm."""
 
         # Initialize stagnation (would it be better initialising it in __init__?)
         self._stagnation = 0
-        while self._can_create_colony():
-            self._search_init()
-
-            # New rule is found by colony
-            # subgroup search is responsible for:
-            #   1. Rule construction from probabilities
-            #   2. Rule pruning
-            new_rule = self._subgroup_search()
-
-            # Discutir essa estrutura aqui:
-            self.__delta_uncovered = len(self.__uncovered_cases)
-            self._subgroup_set_update(new_rule)
-            self.__delta_uncovered -= len(self.__uncovered_cases)
-
-            if self.__delta_uncovered == 0:
-                self._stagnation += 1
-            else:
-                self._stagnation = 0
-                # stagnation - intercolony
-                # j - rule convergence - intracolony
-                #   j fica dentro do subgroup search
-
-            # Is this right? NO
-            # may be mixing stagnation and rules for convergence
-            # if self._stagnation == self.__n_rules_for_convergence:
-            #    break
+        try:
+            while self._can_create_colony():
+                self._run_colony()
+        finally:
+            if self.__pool is not None:
+                self.__pool.shutdown()
+                self.__pool = None
+            if self.__shares_dataset:
+                self._dataset.unshare()
+                self.__shares_dataset = False
 
         return
 
+    def _run_colony(self) -> None:
+        """Execute one colony and update the rule list with its rule."""
+        self._search_init()
+
+        # New rule is found by colony
+        # subgroup search is responsible for:
+        #   1. Rule construction from probabilities
+        #   2. Rule pruning
+        new_rule = self._subgroup_search()
+
+        # Discutir essa estrutura aqui:
+        self.__delta_uncovered = self.__coverage.n_uncovered
+        self._subgroup_set_update(new_rule)
+        self.__delta_uncovered -= self.__coverage.n_uncovered
+
+        if self.__delta_uncovered == 0:
+            self._stagnation += 1
+        else:
+            self._stagnation = 0
+            # stagnation - intercolony
+            # j - rule convergence - intracolony
+            #   j fica dentro do subgroup search
+
     def _can_create_colony(self) -> bool:
         """Return true if conditions for a new colony are satisfied."""
 
@@ -74,8 +97,10 @@ class Esmam(Algorithm):
         # Implementar o delta U, que eh se mudou o numero de casos cobertos
         # de uma colonia pra outra, numero de iteracoes em que delta U eh zero chegando em stag, break
 
-        return len(self.__uncovered_cases) > self.__max_uncovered_cases or \
-            self.__current_colony < self.__n_ants
+        # Stagnation is bounded by the convergence count for now, otherwise
+        # colonies that keep rediscovering rules never stop.
+        return self.__coverage.n_uncovered > self.__max_uncovered_cases and \
+            self._stagnation < self.__n_rules_for_convergence
 
     def _pheromone_init(self) -> None:
         """Initialize pheromone vector."""
@@ -87,51 +112,60 @@ class Esmam(Algorithm):
         """Initialize pheromone and heuristic values
         associated with each item of the dataset.
         """
-        if self.__heuristic == None:
+        if self.__heuristic is None:
             self._heuristic_map()
         self._pheromone_init()
         pass
 
-    def _heuristic_map(self):
-        """Initialize the heuristic values vector."""
-        n_items = self._dataset.get_number_of_items()
-        self.__heuristic = np.fromiter(map(self._calculate_item_heuristic, range(
-            self._dataset.get_number_of_items())), dtype=float)
-
-    def _calculate_item_heuristic(self, item) -> float:
-        """Calculate the heuristic value for an individual item."""
+    def _heuristic_map(self, cases: np.array = None):
+        """Initialize the heuristic values vector.
+        Heuristics are computed over cases only, given as indices or as a
+        boolean mask such as CaseCoverage.uncovered, all tx by default, so
+        that they can be restricted to the uncovered cases of a colony.
+        """
+        case_mask = np.ones(self._dataset.size, dtype=bool)
+        if cases is not None:
+            case_mask[:] = False
+            case_mask[cases] = True
         survival = self._dataset.survival
-        avg_survival = survival.mean()
-
-        # get_tx expect a set of items, even if querying
-        # for tx covered by an individual item
-        items = set([item])
-        tx = self._dataset.get_tx(items)
-        n_tx = len(tx)
+        avg_survival = survival[case_mask].mean(dtype=np.float64)
+
+        # The packed item-by-tx index ANDed with the packed cases and with
+        # the cases of the "above average survival" class gives, by popcount,
+        # every item's number of tx and of tx in the above average class.
+        item_tx = self._dataset.item_tx
+        n_tx = np.bitwise_count(
+            item_tx & np.packbits(case_mask)).sum(axis=1, dtype=np.int64)
+        tx_above_avg = np.bitwise_count(
+            item_tx & np.packbits(case_mask & (survival >= avg_survival))
+        ).sum(axis=1, dtype=np.int64)
+
+        prob1 = np.divide(tx_above_avg, n_tx,
+                          out=np.zeros(len(n_tx)), where=n_tx > 0)
+        prob2 = np.divide(n_tx - tx_above_avg, n_tx,
+                          out=np.zeros(len(n_tx)), where=n_tx > 0)
+        entropy = np.zeros(len(n_tx))
+        for prob in (prob1, prob2):
+            entropy -= prob * np.log2(prob, out=np.zeros(len(prob)),
+                                      where=prob != 0)
 
         # Number of tx covered by the item must be greater
         # then user-set minimum coverage per rule treshold.
-        if n_tx < self.__min_cover_per_rule:
-            return 0
-        else:
-            tx_above_avg = np.sum(survival[tx] >= avg_survival)
-            entropy = 0
-            prob1 = tx_above_avg / n_tx
-            prob2 = (n_tx - tx_above_avg) / n_tx
-            if prob1 != 0:
-                entropy -= prob1 * np.log2(prob1)
-            if prob2 != 0:
-                entropy -= prob2 * np.log2(prob2)
-            return 1 - entropy
+        self.__heuristic = np.where(
+            n_tx < self.__min_cover_per_rule, 0, 1 - entropy)
 
     def _subgroup_search(self) -> rule.Rule:
         """Execute a colony of ants resulting in a new rule."""
+        if self.__n_workers is not None and self.__n_workers > 1:
+            return self._parallel_subgroup_search()
+
         ant: int = 0
         convergence: int = 0
         last_rule: rule.Rule = None
-        best_rule: rule.Rule = None
+        best_rule: rule.Rule = rule.Rule(self._dataset, self._baseline)
 
-        while ant <= self.__n_ants or convergence <= self.__n_rules_for_convergence:
+        while ant < self.__n_ants and \
+                convergence < self.__n_rules_for_convergence:
             current_rule = self.build_description()
             current_rule = self.prune_description(current_rule)
             self.pheromone_update(current_rule)
@@ -146,13 +180,145 @@ class Esmam(Algorithm):
 
         return best_rule
 
+    def _parallel_subgroup_search(self) -> rule.Rule:
+        """Execute a colony of ants resulting in a new rule, running
+        n_workers ants at a time in a process pool.
+        Every ant of a batch sees the same pheromone snapshot and draws
+        from its own random stream, spawned in ant order from the seed, so
+        a seed and a number of workers always give the same rules. The
+        batch's pheromone updates are applied together once it ends.
+        """
+        if self.__pool is None:
+            # Workers map the dataset from shared memory
+            if self._dataset.shared_handle is None:
+                self._dataset.share()
+                self.__shares_dataset = True
+            self.__pool = ProcessPoolExecutor(
+                self.__n_workers, initializer=_init_colony_worker,
+                initargs=(self._dataset, self._baseline,
+                          self.__min_cover_fraction))
 
+        ant: int = 0
+        convergence: int = 0
+        last_rule: rule.Rule = None
+        best_rule: rule.Rule = rule.Rule(self._dataset, self._baseline)
+
+        while ant < self.__n_ants and \
+                convergence < self.__n_rules_for_convergence:
+            n_batch = min(self.__n_workers, self.__n_ants - ant)
+            seeds = self.__seed_sequence.spawn(n_batch)
+            antecedents = self.__pool.map(
+                _run_ant, [self.__pheromone] * n_batch,
+                [self.__heuristic] * n_batch, seeds)
+
+            batch = []
+            for antecedent in antecedents:
+                if ant >= self.__n_ants or \
+                        convergence >= self.__n_rules_for_convergence:
+                    break
+                current_rule = rule.Rule(self._dataset, self._baseline)
+                current_rule.antecedent = set(antecedent)
+                batch.append(current_rule)
+                if current_rule.quality() > best_rule.quality():
+                    best_rule = current_rule
+                if current_rule == last_rule:
+                    convergence += 1
+                else:
+                    convergence = 0
+                last_rule = current_rule
+                ant += 1
+            self.pheromone_update(*batch)
 
-    def _item_probability(self, item: int) -> float:
-        """Calculate item's probability of being picked up by an ant."""
-        numerator = self.__heuristic[item] * self.__pheromone[item]
-        denominator = None
-        pass
+        return best_rule
+
+    def _run_ant(self, pheromone: np.array, heuristic: np.array,
+                 generator: np.random.Generator) -> frozenset:
+        """Construct and prune one rule against the given pheromone and
+        heuristic, drawing from generator; return its antecedent.
+        """
+        self.__pheromone = pheromone
+        self.__heuristic = heuristic
+        self.__generator = generator
+        current_rule = self.prune_description(self.build_description())
+        return frozenset(current_rule.antecedent)
+
+    def prune_description(self, current_rule: rule.Rule) -> rule.Rule:
+        """Prune rule's antecedent while its quality does not decrease and
+        it has more than one item. All single-item removals are evaluated
+        together at each step, the best one being applied.
+        """
+        quality = current_rule.quality()
+        while len(current_rule.antecedent) > 1:
+            items = list(current_rule.antecedent)
+            pruned_quality = current_rule.batch_pruning_quality()
+            best = int(np.argmax(pruned_quality))
+            if pruned_quality[best] < quality:
+                break
+            current_rule.remove_item(items[best])
+            quality = current_rule.quality()
+        return current_rule
+
+    def pheromone_update(self, *rules: rule.Rule) -> None:
+        """Reinforce the pheromone of the items of each rule in proportion
+        to the rule's quality, then normalize. Since normalization only
+        scales the whole vector, updating for several rules at once gives
+        the same pheromone as updating for each in turn.
+        """
+        for current_rule in rules:
+            items = list(current_rule.antecedent)
+            self.__pheromone[items] += \
+                self.__pheromone[items] * current_rule.quality()
+        self.__pheromone /= self.__pheromone.sum()
+
+    def build_description(self) -> rule.Rule:
+        """Construct a rule adding one item drawn by the ant at a time,
+        while the rule covers at least min_cover_per_rule tx.
+        """
+        current_rule = rule.Rule(self._dataset, self._baseline)
+        item_attributes = self._dataset.item_attributes
+        available_items = np.ones(
+            self._dataset.get_number_of_items(), dtype=bool)
+
+        while True:
+            item = self._sample_item(current_rule, available_items)
+            if item is None:
+                break
+            current_rule.add_item(item)
+            if current_rule.get_cover_size() < self.__min_cover_per_rule:
+                current_rule.remove_item(item)
+                break
+            # An attribute takes part in a rule once at most
+            available_items[item_attributes == item_attributes[item]] = False
+
+        return current_rule
+
+    def _item_weights(self, current_rule: rule.Rule,
+                      available_items: np.array) -> np.array:
+        """Calculate the unnormalized probability of each item being
+        picked up by an ant: heuristic times pheromone, for available
+        items present in the rule's cover, and zero otherwise.
+        """
+        weights = self.__heuristic * self.__pheromone
+        mask = available_items
+        if current_rule.antecedent:
+            mask = mask & self._dataset.get_item_mask(current_rule.get_cover())
+        return np.where(mask, weights, 0)
+
+    def _sample_item(self, current_rule: rule.Rule,
+                     available_items: np.array) -> int:
+        """Draw the next item of an ant by roulette wheel, or return None
+        if no item can be picked up.
+        """
+        cumulative = np.cumsum(
+            self._item_weights(current_rule, available_items))
+        if cumulative.size == 0 or not cumulative[-1] > 0:
+            return None
+        # Items with no weight span empty intervals of the wheel, which a
+        # right-sided search never lands on; a draw rounded up to the total
+        # goes to the last item with weight.
+        draw = self.__generator.random() * cumulative[-1]
+        item = np.searchsorted(cumulative, draw, side='right')
+        return int(min(item, np.searchsorted(cumulative, cumulative[-1])))
 
     def _subgroup_set_update(self, new_rule) -> bool:
         """Update list of rules with or without the new rule.
@@ -166,13 +332,30 @@ class Esmam(Algorithm):
                     can_add_rule = False
             if can_add_rule:
                 self._rules.append(new_rule)
-                self.__uncovered_cases = np.setdiff1d(
-                    self.__uncovered_cases, new_rule.get_cover())
+                self.__coverage.add(new_rule.get_cover())
             return True
         else:
             return False
 
 
+_colony_worker: Esmam = None
+
+
+def _init_colony_worker(dataset, baseline, min_cover_per_rule: float) -> None:
+    """Set up the Esmam instance that runs the ants of a worker process."""
+    global _colony_worker
+    _colony_worker = Esmam(dataset, baseline, alpha=0, n_ants=0,
+                           max_uncovered_cases=0, n_rules_converg=0,
+                           min_cover_per_rule=min_cover_per_rule)
+
+
+def _run_ant(pheromone: np.array, heuristic: np.array,
+             seed: np.random.SeedSequence) -> frozenset:
+    """Run one ant in a worker process; see Esmam._run_ant."""
+    return _colony_worker._run_ant(pheromone, heuristic,
+                                   np.random.default_rng(seed))
+
+
 if __name__ == "__main__":
 
     pwd = os.getcwd()
@@ -1,18 +1,17 @@
-import copy
-import json
 import math
 import pandas as pd
 import numpy as np
 import sys
-import statsmodels.api as sm
-from itertools import combinations_with_replacement
 from itertools import chain
 from lifelines import KaplanMeierFitter
 from datetime import datetime
 
-from utils import NoIndent, MyEncoder
+from utils import LogWriter
 from terms_manager import TermsManager
 from rule import Rule
+from run_log import RunLog, LOG_MAX_BYTES
+from similarity import model_pvalues, description_jaccard
+from rule_set import RuleSet
 from dataset import Dataset
 from pruner_prototype import Pruner
 # from pruner import Pruner
@@ -44,6 +43,10 @@ class EsmamDS:
                  logistic_offset=F_LOGISTIC_OFFSET,
                  alpha=ALPHA,
                  seed=0,
+                 log_sample_every=1,
+                 log_colony_end_only=False,
+                 log_max_bytes=LOG_MAX_BYTES,
+                 log_spill_path=None,
                  **kwargs):
         # subgroup comparison (population/complement)
         self.sg_comp = sg_baseline
@@ -60,6 +63,11 @@ class EsmamDS:
         self.alpha = alpha
         ###
         self._seed = seed
+        # Run log: every k-th ant or colony ends only, bounded in memory
+        self.log_sample_every = log_sample_every
+        self.log_colony_end_only = log_colony_end_only
+        self.log_max_bytes = log_max_bytes
+        self.log_spill_path = log_spill_path
 
         # print(3*'-', "execution's parameters", 3*'-')
         # print("sg_baseline:", sg_baseline)
@@ -70,7 +78,8 @@ class EsmamDS:
         # print("logistic_offset:", logistic_offset)
         # print()
 
-        self.discovered_rule_list = []
+        self._RuleSet = RuleSet()
+        self.discovered_rule_list = self._RuleSet.rules
         self._Dataset = None
         self._TermsManager = None
         self._Pruner = None
@@ -79,10 +88,7 @@ class EsmamDS:
         self._no_of_uncovered_cases = None
         self._stagnation = 0
         self._iterations = 0
-        self._log_iterations = {}
-        self._log_heuristic_table = {}
-        self._log_term_count = {}
-        self._log_logistic_count = {}
+        self._RunLog = None
         self._time = None
 
     @property
@@ -117,14 +123,14 @@ class EsmamDS:
         return False
 
     def get_list(self):
-        """Return a deep copy of the list of discovered rules."""
-        return copy.deepcopy(self.discovered_rule_list)
+        """Return a shallow copy of the list of discovered rules."""
+        return self._RuleSet.view()
 
     def _add_rule(self, rule: Rule):
         """Append rule to the list of discovered rules and update the number of
         total covered cases with the number of cases covered by this rule.
         """
-        self.discovered_rule_list.append(rule)
+        self._RuleSet.append(rule)
         self._Dataset.update_covered_cases(rule.sub_group_cases)
         return
 
@@ -133,7 +139,7 @@ class EsmamDS:
         the number of total covered cases removing the cases covered by removed
         rule.
         """
-        rule = self.discovered_rule_list.pop(rule_idx)
+        rule = self._RuleSet.pop(rule_idx)
         self._Dataset.remove_covered_cases(rule.sub_group_cases)
         return
 
@@ -146,8 +152,12 @@ class EsmamDS:
         if new_rule.p_value >= self.alpha:
             return False
 
-        # compare new_rule with rules already in the list
+        # compare new_rule with rules already in the list; rules sharing no
+        # attribute with new_rule always fall in the no-intersection case
+        shared = self._RuleSet.sharing_attributes(new_rule)
         for rule_idx, rule in enumerate(rule_list):
+            if shared is not None and rule not in shared:
+                continue
 
             # CASE: equal rules
             if new_rule.equals(rule):
@@ -193,7 +203,7 @@ class EsmamDS:
                                 new_rule, rule, self._TermsManager)
 
                         # modif_rule can be added
-                        if self._can_add_rule(modif_rule, self.get_list()):
+                        if self._can_add_rule(modif_rule, self._RuleSet.view()):
                             self._add_rule(modif_rule)
                             if new_rule.is_exceptional(modif_rule, self.alpha):
                                 continue
@@ -212,7 +222,7 @@ class EsmamDS:
                         # case: root and merge have similar models
                         if not root_rule.is_exceptional(merged_rule, self.alpha):
                             # root_rule can be added
-                            if self._can_add_rule(root_rule, self.get_list()):
+                            if self._can_add_rule(root_rule, self._RuleSet.view()):
                                 self._add_rule(root_rule)
                                 if new_rule.is_exceptional(root_rule, self.alpha):
                                     continue
@@ -223,12 +233,12 @@ class EsmamDS:
                         # case: root and merge have different models
                         else:
                             add_merge = self._can_add_rule(
-                                merged_rule, self.get_list())
+                                merged_rule, self._RuleSet.view())
                             if add_merge:
                                 self._add_rule(merged_rule)
 
                             add_root = self._can_add_rule(
-                                root_rule, self.get_list())
+                                root_rule, self._RuleSet.view())
                             if add_root:
                                 self._add_rule(root_rule)
 
@@ -285,6 +295,14 @@ class EsmamDS:
             self._TermsManager,
             self.sg_comp
         )
+        self._RunLog = RunLog(
+            self._TermsManager.get_term_keys(),
+            len(self._TermsManager.get_attr_values()),
+            sample_every=self.log_sample_every,
+            colony_end_only=self.log_colony_end_only,
+            max_bytes=self.log_max_bytes,
+            spill_path=self.log_spill_path
+        )
         self._no_of_uncovered_cases = self._Dataset.get_no_of_uncovered_cases()
         self._get_population_Survival()
 
@@ -309,30 +327,26 @@ class EsmamDS:
                 break
 
             # Initialize rules
-            previous_rule = Rule(self._Dataset, self.sg_comp)
-            best_rule = copy.deepcopy(previous_rule)
+            previous_terms = set()  # terms of the previous ant's rule
+            best_rule = Rule(self._Dataset, self.sg_comp)
 
             # Local search, each iteration represents an colony.
-            log_ants = {}
             while not self._local_stopping_condition(ant_index, converg_test_index):
-                log_ants[ant_index] = {}
 
                 # ant creates an empty rule
                 current_rule = Rule(self._Dataset, self.sg_comp)
                 current_rule.construct(
                     self._TermsManager, self.min_case_per_rule
                 )
-                log_ants[ant_index]['r_const'] = current_rule.antecedent
-                log_ants[ant_index]['r_const_ft'] = current_rule.fitness
+                const_ids = self._TermsManager.get_term_ids(current_rule.antecedent)
+                const_fitness = current_rule.fitness
 
                 # print("---Ant", ant_index, "found:")
                 # print("\tRaw rule:", current_rule.antecedent)
                 current_rule = self._Pruner.prune(current_rule)
-                log_ants[ant_index]['r_pr'] = current_rule.antecedent
-                log_ants[ant_index]['r_pr_ft'] = current_rule.fitness
                 # print("\tPruned rule:", current_rule.antecedent)
 
-                if current_rule.equals(previous_rule):
+                if current_rule.get_terms() == previous_terms:
                     converg_test_index += 1
                 else:
                     converg_test_index = 1
@@ -340,21 +354,27 @@ class EsmamDS:
                         # best_rule = copy.deepcopy(current_rule)
                         best_rule = current_rule
 
-                log_ants[ant_index]['pheromone_table'] = self._TermsManager.get_pheromone_table(
+                self._RunLog.record_ant(
+                    self._iterations, ant_index, const_ids, const_fitness,
+                    self._TermsManager.get_term_ids(current_rule.antecedent),
+                    current_rule.fitness,
+                    self._TermsManager.get_table_arrays()['pheromone']
                 )
 
                 self._TermsManager.pheromone_updating(
                     current_rule.antecedent, current_rule.fitness
                 )
-                previous_rule = copy.deepcopy(current_rule)
+                previous_terms = current_rule.get_terms()
                 ant_index += 1
 
             # End-of-colony: att rule-list and covered cases
             prev_uncover = self._no_of_uncovered_cases
             ## prev_uncover: casos nao cobertos pelas regras geradas ate a iteracao atual que estao na lista de regras ##
-            if self._can_add_rule(best_rule, self.get_list()):
+            if self._can_add_rule(best_rule, self._RuleSet.view()):
                 self._add_rule(best_rule)
                 self._no_of_uncovered_cases = self._Dataset.get_no_of_uncovered_cases()
+            # the views taken while comparing best_rule are gone
+            self._RuleSet.release()
 
             # check stagnation of the data set
             if (prev_uncover - self._no_of_uncovered_cases) == 0:
@@ -362,17 +382,13 @@ class EsmamDS:
             else:
                 self._stagnation = 0
 
-            # saves iteration logs
-            self._log_iterations[self._iterations] = log_ants.copy()
-            # needs to be saved before pheromone_init()
-            self._log_term_count[self._iterations] = self._TermsManager.get_counts_table(
-            )
-            self._log_heuristic_table[self._iterations] = self._TermsManager.get_heuristic_table(
-            )
             # updates
             self._TermsManager.att_discovered_terms(best_rule.antecedent)
-            # needs to be saveed after att_discovered_terms()
-            self._log_logistic_count[self._iterations] = self._TermsManager.get_logistic_table(
+            # saves iteration logs: before pheromone_init(), after att_discovered_terms()
+            tables = self._TermsManager.get_table_arrays()
+            self._RunLog.record_colony(
+                self._iterations, tables['counts'], tables['heuristic'],
+                tables['logistic_count']
             )
 
             self._iterations += 1
@@ -457,73 +473,18 @@ class EsmamDS:
     def _save_RuleSet(self, save_name):
         log_file = '{}_RuleSet.txt'.format(save_name)
 
-        # calc matrix functions: pval and description (True values for similarity)
-        def sim_model_matrix(rule_list, db, VAR_TIME_NAME='survival_time', VAR_EVENT_NAME='survival_status'):
-            rules_idx = list(range(len(rule_list)))
-            matrix = pd.DataFrame(
-                data=None, index=rules_idx, columns=rules_idx)
-            for r1_pos, r2_pos in combinations_with_replacement(rules_idx, 2):
-                r1_cases = rule_list[r1_pos].sub_group_cases
-                r2_cases = rule_list[r2_pos].sub_group_cases
-
-                times = db[VAR_TIME_NAME][r1_cases].to_list(
-                ) + db[VAR_TIME_NAME][r2_cases].to_list()
-                events = db[VAR_EVENT_NAME][r1_cases].to_list(
-                ) + db[VAR_EVENT_NAME][r2_cases].to_list()
-                group_id = ['r1'] * db[VAR_TIME_NAME][r1_cases].shape[0] + \
-                    ['r2'] * db[VAR_TIME_NAME][r2_cases].shape[0]
-                try:
-                    _, p_value = sm.duration.survdiff(
-                        time=times, status=events, group=group_id)
-                except:  # apparently, get error when rules are equal
-                    p_value = 1.0
-
-                if r1_pos == r2_pos:
-                    matrix.loc[r1_pos, r1_pos] = p_value
-                else:
-                    matrix.loc[r1_pos, r2_pos] = p_value
-                    matrix.loc[r2_pos, r1_pos] = p_value
-
-            matrix_bool = matrix >= self.alpha
-            np.fill_diagonal(matrix_bool.values, False)
-            return matrix_bool
-
-        def sim_dscpt_matrix(rule_list, small=False):
-            rules_idx = list(range(len(rule_list)))
-            matrix = pd.DataFrame(
-                data=None, index=rules_idx, columns=rules_idx)
-            for r1_pos, r2_pos in combinations_with_replacement(rules_idx, 2):
-                r1_terms = rule_list[r1_pos].get_terms()
-                r2_terms = rule_list[r2_pos].get_terms()
-
-                if small:
-                    minor = min([len(r1_terms), len(r2_terms)])
-                    intersection = set(r1_terms).intersection(r2_terms)
-                    jaccard_index = len(intersection) / minor
-                else:
-                    union = r1_terms.union(r2_terms)
-                    intersection = set(r1_terms).intersection(r2_terms)
-                    jaccard_index = len(intersection) / len(union)
-
-                if r1_pos == r2_pos:
-                    matrix.loc[r1_pos, r1_pos] = jaccard_index
-                else:
-                    matrix.loc[r1_pos, r2_pos] = jaccard_index
-                    matrix.loc[r2_pos, r1_pos] = jaccard_index
-
-            matrix_bool = matrix >= JACCARD_DSCPT_THRESHOLD
-            np.fill_diagonal(matrix_bool.values, False)
-            return matrix_bool
-
         # print all rules representatives
         f = open(log_file, "a+")
         f.write('DISCOVERED SUBGROUPS')
         f.close()
 
         printed_rules = []
-        sim_models = sim_model_matrix(
-            self.discovered_rule_list, self._Dataset.get_data())
-        sim_descript = sim_dscpt_matrix(self.discovered_rule_list)
+        # similarity matrices: pval and description (True values for similarity)
+        sim_models = model_pvalues(self._Dataset, self.discovered_rule_list) >= self.alpha
+        np.fill_diagonal(sim_models, False)
+        sim_descript = description_jaccard(
+            self.discovered_rule_list) >= JACCARD_DSCPT_THRESHOLD
+        np.fill_diagonal(sim_descript, False)
 
         for index, rule in enumerate(self.discovered_rule_list):
 
@@ -538,7 +499,7 @@ class EsmamDS:
 
             # similar models:
             if sim_models[index].any():
-                similar = list(sim_models[index][sim_models[index]].index)
+                similar = np.flatnonzero(sim_models[index]).tolist()
                 for idx in similar:
                     r_sim = self.discovered_rule_list[idx]
                     if r_sim.id in printed_rules:
@@ -551,7 +512,7 @@ class EsmamDS:
 
             # similar descriptions:
             if sim_descript[index].any():
-                similar = list(sim_descript[index][sim_descript[index]].index)
+                similar = np.flatnonzero(sim_descript[index]).tolist()
                 for idx in similar:
                     r_sim = self.discovered_rule_list[idx]
                     if r_sim.id in printed_rules:
@@ -571,19 +532,13 @@ class EsmamDS:
         # print('... saved: {}'.format(log_file))
         return
 
-    def save_logs(self, save_path):
-        # JSON LOG FILE
-        # rule model
-        rules = {}
-        covered_cases = {}
-        size = 0
-        for _, rule in enumerate(self.discovered_rule_list):
-            idx, dic = rule.get_result()
-            rules[idx] = dic.copy()
-            covered_cases[idx] = rule.sub_group_cases
-            size += len(rule.antecedent)
-
+    def save_logs(self, save_path, compress=False):
+        """Stream the run log to <save_path>_log.ndjson (.gz if compress), one
+        record per line: params, metrics, run, rules, terms, ants and colonies.
+        Load it back with utils.read_log."""
         # metrics
+        covered_cases = {rule.id: rule.sub_group_cases for rule in self.discovered_rule_list}
+        size = sum(len(rule.antecedent) for rule in self.discovered_rule_list)
         metrics = {}
         if len(covered_cases) == 0:
             ruleCoverage = 0
@@ -619,28 +574,31 @@ class EsmamDS:
         run = {
             'timestamp': str(datetime.now()),
             'data_path': self._data_path,
-            'data_shape': NoIndent(self._Dataset.get_data().shape),
+            'data_shape': self._Dataset.get_data().shape,
             'num_of_terms': self._TermsManager.get_num_terms(),
             'run_time': str(self._time),
             'num_iterations': self._iterations,
             'np_seed': self._seed,
-            'uncovered_cases': NoIndent(self._Dataset.get_uncovered_cases()),
-            'log_iterations': NoIndent(self._log_iterations),
-            'log_heuristics': NoIndent(self._log_heuristic_table),
-            'log_count_execution': NoIndent(self._log_term_count),
-            'log_count_discover': NoIndent(self._log_logistic_count)
+            'uncovered_cases': self._Dataset.get_uncovered_cases(),
+            'log_dropped_records': self._RunLog.no_dropped,
+            'exceptionality_cache': self._Dataset.get_exceptionality_cache().stats()
         }
 
-        # unified log for json
-        log = {
-            'params': params,
-            'metrics': metrics,
-            'model': rules,
-            'run': run
-        }
-        log_file = '{}_log.json'.format(save_path)
-        with open(log_file, 'w') as f:
-            f.write(json.dumps(log, indent=2, cls=MyEncoder))
+        log_file = '{}_log.ndjson'.format(save_path) + ('.gz' if compress else '')
+        with LogWriter(log_file) as log:
+            log.write('params', params)
+            log.write('metrics', metrics)
+            log.write('run', run)
+            # rule model
+            for rule in self.discovered_rule_list:
+                idx, dic = rule.get_result()
+                log.write('rule', dict(id=idx, **dic))
+            # run log, ants and colonies as term ids
+            log.write('terms', self._RunLog.term_keys)
+            for row in self._RunLog.iter_ants():
+                log.write('ant', row)
+            for row in self._RunLog.iter_colonies():
+                log.write('colony', row)
         # print('... saved log-file: {}'.format(log_file))
         return
 
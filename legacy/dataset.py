@@ -2,6 +2,8 @@ import pandas as pd
 import numpy as np
 from collections import OrderedDict
 
+from similarity import PairwiseLogRank, PairCache
+
 
 class Dataset:
     # usando vetor de bits https://numpy.org/doc/stable/reference/generated/numpy.packbits.html
@@ -35,7 +37,8 @@ class Dataset:
 
         # to be removed, should be in algorithm, np.array
         # initially, all observations are uncovered
-        self._uncovered_cases = [True]*data.shape[0]
+        self._uncovered_cases = np.ones(data.shape[0], dtype=bool)
+        self._no_of_uncovered_cases = data.shape[0]
 
         # to be removed
         self._original_data = data.copy()   # DataFrame --- Redundante ---
@@ -48,7 +51,11 @@ class Dataset:
         # self._surv_name_col
 
         # self._count = [0]*data.shape[0] - deveria estar provavelmente no Terms Manager
-        self._count = [0]*data.shape[0]
+        self._count = np.zeros(data.shape[0], dtype=np.int32)
+
+        # two-sample log-rank shared by rule comparisons, and their p-values
+        self._logrank = None
+        self._exceptionality_cache = PairCache()
 
         self._constructor(attr_survival_name, attr_event_name)
 
@@ -96,21 +103,31 @@ class Dataset:
         return {("attr", "valor"): 1}
 
     def remove_covered_cases(self, cases):
-        for case in cases:
-            if self._count[case] <= 1:  # if covered only once > becomes uncovered
-                self._count[case] = 0
-                self._uncovered_cases[case] = True
-            else:                       # if covered more than once > decrements cover count
-                self._count[case] -= 1
+        # cases covered only once become uncovered, the others decrement cover count
+        cases = np.asarray(cases, dtype=np.intp)
+        before = self._count[cases]
+        after = np.maximum(before - 1, 0)
+        self._count[cases] = after
+        self._uncovered_cases[cases] = after == 0
+        self._no_of_uncovered_cases += int(np.count_nonzero((before > 0) & (after == 0)))
         return
 
     def update_covered_cases(self, covered_cases):
-        # set flag for rule-covered cases
-        for case in covered_cases:
-            self._uncovered_cases[case] = False
-            self._count[case] += 1
+        # set flag for rule-covered cases, which are unique
+        covered_cases = np.asarray(covered_cases, dtype=np.intp)
+        self._no_of_uncovered_cases -= int(np.count_nonzero(self._uncovered_cases[covered_cases]))
+        self._uncovered_cases[covered_cases] = False
+        self._count[covered_cases] += 1
         return
 
+    def get_logrank(self):
+        if self._logrank is None:
+            self._logrank = PairwiseLogRank(self.survival_times[1], self.events[1])
+        return self._logrank
+
+    def get_exceptionality_cache(self):
+        return self._exceptionality_cache
+
     def get_case_count(self):
         return self._count
 
@@ -121,13 +138,16 @@ class Dataset:
         return self._original_data.copy()
 
     def get_cases_coverage(self):   # returns a bool list with True for covered cases
-        return [covered == False for covered in self._uncovered_cases]
+        return (~self._uncovered_cases).tolist()
 
     def get_no_of_uncovered_cases(self):
-        return sum(self._uncovered_cases)
+        return self._no_of_uncovered_cases
+
+    def get_uncovered_mask(self):   # returns a bool array with True for uncovered cases
+        return self._uncovered_cases.copy()
 
     def get_uncovered_cases(self):
-        return list(self._original_data[self._uncovered_cases].index)
+        return self._original_data.index[self._uncovered_cases].tolist()
 
     def get_instances(self):
         return list(range(len(self.data)))
@@ -1,5 +1,4 @@
-import copy
-from rule import Rule
+from rule import Rule, RuleCandidate
 
 
 class Pruner:
@@ -15,17 +14,21 @@ class Pruner:
         or rule's length is greater than one condition.
         At each iteration all conditions are tested for removal, being chosen 
         the one which promotes maximum overall quality improvement.
+        Candidates are antecedent/cover pairs; a Rule is only built for a pruned
+        result, otherwise the received rule is returned.
         """
-        self.current_rule = copy.deepcopy(rule)
+        received = RuleCandidate(rule.antecedent.copy(), rule.bitmap,
+                                 rule.p_value, rule.fitness)
+        current = received
         if verbose:
             print()
             print(50*'*')
             print()
-            print("Received for pruning:", self.current_rule.antecedent)
-            print("\nOriginal fitness:", self.current_rule.fitness)
+            print("Received for pruning:", current.antecedent)
+            print("\nOriginal fitness:", current.fitness)
             print()
 
-        if len(self.current_rule.antecedent) == 1:
+        if len(current.antecedent) == 1:
             if verbose:
                 print("Cannot be pruned: one antecedent only.")
                 print()
@@ -34,36 +37,35 @@ class Pruner:
             if verbose:
                 print("\tInitializing pruning procedure\n")
 
-            while (len(self.current_rule.antecedent) > 1):
+            while (len(current.antecedent) > 1):
 
                 pruned_rule_has_better_quality = False
-                current_antecedent = self.current_rule.antecedent.copy()
 
                 if verbose:
                     print("\tIteration {}, pruning".format(pruning_iteration),
-                          current_antecedent, '\n')
+                          current.antecedent, '\n')
 
-                for attr in current_antecedent:
-                    pruned_rule = Rule(self._dataset, self._comparison)
-                    pruned_rule.antecedent = current_antecedent.copy()
+                candidates = {}
+                for attr in current.antecedent:
+                    antecedent = current.antecedent.copy()
+                    antecedent.pop(attr, None)
+                    candidates[attr] = RuleCandidate(
+                        antecedent, self._terms_mgr.get_cases_bitmap(antecedent))
+                Rule.evaluate(self._dataset, self._comparison, candidates.values())
 
-                    pruned_rule.antecedent.pop(attr, None)
-                    pruned_rule.set_cases(
-                        self._terms_mgr.get_cases(pruned_rule.antecedent)
-                    )
-                    pruned_rule.set_fitness()
+                for attr, pruned_rule in candidates.items():
                     if verbose:
                         print("\t\t>> Fitness without '{}':".format(
                             attr), pruned_rule.fitness)
 
-                    if pruned_rule.fitness >= self.current_rule.fitness:
+                    if pruned_rule.fitness >= current.fitness:
                         pruned_rule_has_better_quality = True
-                        self.current_rule = copy.deepcopy(pruned_rule)
+                        current = pruned_rule
                         if verbose:
                             print(
                                 "\n\t\t\tPruned rule maintains or improves quality.")
                             print("\n\t\t\tSetting resulting rule to",
-                                  self.current_rule.antecedent)
+                                  current.antecedent)
                     else:
                         if verbose:
                             print("\n\t\t\tPruned rule decreases quality.")
@@ -79,9 +81,13 @@ class Pruner:
 
             if verbose:
                 print("\tEnd of pruning procedure, returning rule:\n")
-                print("\t\t@ Antecedent:", self.current_rule.antecedent)
+                print("\t\t@ Antecedent:", current.antecedent)
                 print()
-                print("\t\t@ Fitness:", self.current_rule.fitness)
+                print("\t\t@ Fitness:", current.fitness)
                 input()
 
+        if current is received:
+            self.current_rule = rule
+        else:
+            self.current_rule = Rule.materialise(self._dataset, self._comparison, current)
         return self.current_rule
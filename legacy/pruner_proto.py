@@ -44,8 +44,8 @@ class Pruner:
                 for attr in self.current_rule.antecedent:
                     pruned_rule.antecedent = self.current_rule.antecedent.copy()
                     pruned_rule.antecedent.pop(attr, None)
-                    pruned_rule.set_cases(
-                        self._terms_mgr.get_cases(
+                    pruned_rule.set_bitmap(
+                        self._terms_mgr.get_cases_bitmap(
                             pruned_rule.antecedent
                         )
                     )
@@ -79,8 +79,8 @@ class Pruner:
                 pruning_iteration += 1
 
             # Setting final rule's fitness
-            self.current_rule.set_cases(
-                self._terms_mgr.get_cases(self.current_rule.antecedent)
+            self.current_rule.set_bitmap(
+                self._terms_mgr.get_cases_bitmap(self.current_rule.antecedent)
             )
             self.current_rule.set_fitness()
 
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import statsmodels.api as sm
 from lifelines import KaplanMeierFitter
@@ -5,6 +6,17 @@ from lifelines import KaplanMeierFitter
 from utils import NoIndent
 
 
+class RuleCandidate:
+    """Lightweight antecedent/cover pair, evaluated without building a Rule."""
+    __slots__ = ('antecedent', 'bitmap', 'p_value', 'fitness')
+
+    def __init__(self, antecedent, bitmap, p_value=None, fitness=0.0):
+        self.antecedent = antecedent
+        self.bitmap = bitmap
+        self.p_value = p_value
+        self.fitness = fitness
+
+
 class Rule:
 
     def __init__(self, dataset, comp):
@@ -12,6 +24,8 @@ class Rule:
         self.antecedent = {}
         self.sub_group_cases = dataset.get_instances()
         self.no_covered_cases = len(self.sub_group_cases)
+        self._bitmap = np.packbits(np.ones(dataset.size, dtype=bool))  # packed sub_group_cases
+        self._union_cover = False  # cover is the union of its terms' covers (root/merge)
         self.fitness = 0.0
         self.p_value = None
         self._string_repr = ()
@@ -33,6 +47,10 @@ class Rule:
     def complement_mean_survival(self):
         return self._Dataset.survival_times[1].iloc[self._complement_cases].mean()
 
+    @property
+    def bitmap(self):
+        return self._bitmap
+
     @property
     def id(self):
         return self._string_repr[0]
@@ -42,27 +60,27 @@ class Rule:
         return self._string_repr[1]
 
     def is_exceptional(self, rule, alpha):
-        # calculate p-value btw (new_rule, rule)
-        times = self._Dataset.survival_times[1][self.sub_group_cases].to_list(
-        ) + self._Dataset.survival_times[1][rule.sub_group_cases].to_list()
-
-        events = self._Dataset.events[1][self.sub_group_cases].to_list(
-        ) + self._Dataset.events[1][rule.sub_group_cases].to_list()
-
-        group_id = ['self']*self._Dataset.survival_times[1][self.sub_group_cases].shape[0] + \
-            ['rule']*self._Dataset.survival_times[1][rule.sub_group_cases].shape[0]
-
-        try:
-            _, p_val = sm.duration.survdiff(
-                time=times, status=events, group=group_id)
-        except:  # equal rules/ rules with no event
-            p_val = 1
+        # calculate p-value btw (new_rule, rule), cached by both rules' covers;
+        # the test is symmetric, so is the key
+        cache = self._Dataset.get_exceptionality_cache()
+        key = frozenset((self.cover_key(), rule.cover_key()))
+        p_val = cache.get(key)
+        if p_val is None:
+            # equal rules/ rules with no event get p-value 1
+            p_val = self._Dataset.get_logrank().pvalue(
+                np.unpackbits(self._bitmap, count=self._Dataset.size).view(bool),
+                np.unpackbits(rule.bitmap, count=self._Dataset.size).view(bool))
+            cache.put(key, p_val)
 
         if p_val >= alpha:
             return False
         else:
             return True
 
+    def cover_key(self):
+        """Return a key identifying the rule's cover by its terms."""
+        return frozenset(self.get_terms()), self._union_cover
+
     def is_in(self, rule):
         attr_intersec = self.get_attributes().intersection(rule.get_attributes())
         if attr_intersec == rule.get_attributes():
@@ -84,17 +102,17 @@ class Rule:
 
     def _construct_from_items(self, items, terms_mng):
         antecedent = {}
-        cases = set()
+        bitmap = np.zeros_like(self._bitmap)
         for (attr, val) in items:
             if attr not in antecedent:
                 antecedent[attr] = {val}
             else:
                 antecedent[attr] = set(antecedent[attr]).union({val})
-            cases = cases.union(
-                set(terms_mng.get_term(attr, val).covered_cases))
+            bitmap |= terms_mng.get_term(attr, val).bitmap
 
         self.antecedent = antecedent.copy()
-        self.set_cases(list(cases))
+        self._union_cover = True
+        self.set_bitmap(bitmap)
         self.set_fitness()
         return
 
@@ -123,49 +141,85 @@ class Rule:
         return set(terms)
 
     def set_cases(self, cases):
-        self.sub_group_cases = cases
-        self.no_covered_cases = len(cases)
-        self._complement_cases = list(
-            set(self.sub_group_cases) ^ set(self._Dataset.get_instances()))
+        covered = np.zeros(self._Dataset.size, dtype=bool)
+        covered[np.asarray(cases, dtype=np.intp)] = True
+        self.set_bitmap(np.packbits(covered))
+        return
+
+    def set_bitmap(self, bitmap):
+        # sub group and complement cases are kept as sorted lists
+        self._bitmap = bitmap
+        covered = np.unpackbits(bitmap, count=self._Dataset.size).view(bool)
+        self.sub_group_cases = covered.nonzero()[0].tolist()
+        self.no_covered_cases = len(self.sub_group_cases)
+        self._complement_cases = (~covered).nonzero()[0].tolist()
         return
 
     def set_fitness(self):
+        self.p_value = self._p_value(self._Dataset, self._comparison, self.antecedent,
+                                     self.sub_group_cases, self._complement_cases)
+        self.fitness = 1 - self.p_value
+
+        return
+
+    @staticmethod
+    def _p_value(dataset, comparison, antecedent, sub_group_cases, complement_cases):
+        p_value = None
         # against population
-        if self._comparison == 'population':
-            times = self._Dataset.survival_times[1][self.sub_group_cases].to_list(
-            ) + self._Dataset.survival_times[1].to_list()
-
-            events = self._Dataset.events[1][self.sub_group_cases].to_list(
-            ) + self._Dataset.events[1].to_list()
-            
-            group_id = ['sg'] * self._Dataset.survival_times[1][self.sub_group_cases].shape[0] + \
-                ['pop'] * self._Dataset.survival_times[1].shape[0]
+        if comparison == 'population':
+            times = dataset.survival_times[1][sub_group_cases].to_list(
+            ) + dataset.survival_times[1].to_list()
+
+            events = dataset.events[1][sub_group_cases].to_list(
+            ) + dataset.events[1].to_list()
+
+            group_id = ['sg'] * dataset.survival_times[1][sub_group_cases].shape[0] + \
+                ['pop'] * dataset.survival_times[1].shape[0]
             try:
-                _, self.p_value = sm.duration.survdiff(
+                _, p_value = sm.duration.survdiff(
                     time=times, status=events, group=group_id)
             except:
                 print("!! Raise < sm.duration.survdiff > except rule-fitness:")
                 print('...baseline: population')
-                print('rule: {}'.format(self.antecedent))
-                self.p_value = 1
+                print('rule: {}'.format(antecedent))
+                p_value = 1
         # against complement
-        if self._comparison == 'complement':
-            sg = pd.Series('sub_group', index=self.sub_group_cases)
-            cpm = pd.Series('complement', index=self._complement_cases)
+        if comparison == 'complement':
+            sg = pd.Series('sub_group', index=sub_group_cases)
+            cpm = pd.Series('complement', index=complement_cases)
             group = pd.concat([sg, cpm], axis=0,
                               ignore_index=False).sort_index()
             try:
-                _, self.p_value = sm.duration.survdiff(
-                    self._Dataset.survival_times[1], self._Dataset.events[1], group)
+                _, p_value = sm.duration.survdiff(
+                    dataset.survival_times[1], dataset.events[1], group)
             except:
                 print("!! Raise < sm.duration.survdiff > except rule-fitness:")
                 print('...baseline: complement')
-                print('rule: {}'.format(self.antecedent))
-                self.p_value = 1
-        self.fitness = 1 - self.p_value
-
+                print('rule: {}'.format(antecedent))
+                p_value = 1
+        return p_value
+
+    @staticmethod
+    def evaluate(dataset, comparison, candidates):
+        """Set p-value and fitness of each RuleCandidate as set_fitness would."""
+        for candidate in candidates:
+            covered = np.unpackbits(candidate.bitmap, count=dataset.size).view(bool)
+            candidate.p_value = Rule._p_value(dataset, comparison, candidate.antecedent,
+                                              covered.nonzero()[0].tolist(),
+                                              (~covered).nonzero()[0].tolist())
+            candidate.fitness = 1 - candidate.p_value
         return
 
+    @staticmethod
+    def materialise(dataset, comparison, candidate):
+        """Build a full Rule from an evaluated RuleCandidate."""
+        rule = Rule(dataset, comparison)
+        rule.antecedent = candidate.antecedent.copy()
+        rule.set_bitmap(candidate.bitmap)
+        rule.p_value = candidate.p_value
+        rule.fitness = candidate.fitness
+        return rule
+
     def construct(self, terms_mgr, min_case_per_rule):
         """Construct the antecedent of a rule."""
         # ANTECEDENT CONSTRUCTION
@@ -175,18 +229,19 @@ class Rule:
             if not term:
                 break
 
-            covered_cases = list(set(term.covered_cases) &
-                                 set(self.sub_group_cases))
+            covered_cases = term.bitmap & self._bitmap
 
             # if len(covered_cases) > 1: == version with subgroup size quality component
-            if len(covered_cases) >= min_case_per_rule:
+            if np.bitwise_count(covered_cases).sum() >= min_case_per_rule:
                 self.antecedent[term.attribute] = term.value
-                self.set_cases(covered_cases)
+                self._bitmap = covered_cases
                 terms_mgr.update_availability(term.attribute)
                 terms_mgr.add_count(term.attribute, term.value)
             else:
                 break
 
+        # case lists are only built for the final antecedent
+        self.set_bitmap(self._bitmap)
         self.set_fitness()
         return
 
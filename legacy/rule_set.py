@@ -0,0 +1,51 @@
+class RuleSet:
+    """List of discovered rules indexed by attribute, so that comparisons can
+    skip rules sharing no attribute with a candidate. Popped rules stay indexed
+    until release(), as views taken before the pop may still hold them."""
+
+    def __init__(self):
+        self.rules = []
+        self._attr_index = {}  # {Attr: {rule}}
+        self._popped = []
+
+    def __len__(self):
+        return len(self.rules)
+
+    def append(self, rule):
+        self.rules.append(rule)
+        self._popped = [popped for popped in self._popped if popped is not rule]
+        for attr in rule.get_attributes():
+            self._attr_index.setdefault(attr, set()).add(rule)
+        return
+
+    def pop(self, rule_idx):
+        rule = self.rules.pop(rule_idx)
+        self._popped.append(rule)
+        return rule
+
+    def release(self):
+        """Drop popped rules from the index, once no view can still hold them."""
+        for rule in self._popped:
+            for attr in rule.get_attributes():
+                indexed = self._attr_index.get(attr)
+                if indexed is not None:
+                    indexed.discard(rule)
+                    if not indexed:
+                        del self._attr_index[attr]
+        self._popped = []
+        return
+
+    def view(self):
+        """Return a shallow copy of the rule list; rules are shared, not copied."""
+        return list(self.rules)
+
+    def sharing_attributes(self, rule):
+        """Return the rules indexed that share an attribute with rule, or None
+        when rule has no attributes (every rule must then be compared)."""
+        attrs = rule.get_attributes()
+        if not attrs:
+            return None
+        shared = set()
+        for attr in attrs:
+            shared |= self._attr_index.get(attr, set())
+        return shared
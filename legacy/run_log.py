@@ -0,0 +1,149 @@
+import glob
+import os
+
+import numpy as np
+
+LOG_MAX_BYTES = 64 * 2**20  # hard cap on in-memory log buffers
+COLONY_SHARE = 0.125  # share of the cap reserved for per-colony tables
+
+
+class ColumnBuffer:
+    """Table of NumPy columns growing up to a fixed capacity. Full buffers are
+    spilled to .npz chunks when a spill directory is given, otherwise further
+    rows are dropped and counted."""
+    INITIAL_ROWS = 256
+
+    def __init__(self, columns, max_bytes, spill_path=None, name='log'):
+        # columns: {name: (dtype, width)}, width 0 for scalar columns
+        self._columns = columns
+        row_bytes = sum(np.dtype(dtype).itemsize * max(width, 1)
+                        for dtype, width in columns.values())
+        self.capacity = max(1, int(max_bytes // row_bytes))
+        self._data = self._allocate(min(self.capacity, self.INITIAL_ROWS))
+        self._spill_path = spill_path
+        self._name = name
+        self._no_chunks = 0
+        self.no_rows = 0  # rows currently in memory
+        self.no_dropped = 0
+
+    def _allocate(self, no_rows):
+        return {col: np.empty((no_rows, width) if width else no_rows, dtype=dtype)
+                for col, (dtype, width) in self._columns.items()}
+
+    def append(self, **row):
+        if self.no_rows == self.capacity:
+            if self._spill_path is None:
+                self.no_dropped += 1
+                return False
+            self.spill()
+        elif self.no_rows == len(self._data['colony']):
+            # grows geometrically, never beyond capacity
+            data = self._allocate(min(2 * self.no_rows, self.capacity))
+            for col in self._columns:
+                data[col][:self.no_rows] = self._data[col]
+            self._data = data
+        for col, value in row.items():
+            self._data[col][self.no_rows] = value
+        self.no_rows += 1
+        return True
+
+    def spill(self):
+        os.makedirs(self._spill_path, exist_ok=True)
+        chunk_file = os.path.join(self._spill_path, '{}_{:05d}.npz'.format(self._name, self._no_chunks))
+        np.savez(chunk_file, **{col: data[:self.no_rows] for col, data in self._data.items()})
+        self._no_chunks += 1
+        self.no_rows = 0
+        return
+
+    def iter_chunks(self):
+        """Yield {name: array} for each spilled chunk, then for in-memory rows."""
+        for chunk_file in self._chunk_files():
+            with np.load(chunk_file) as chunk:
+                yield {col: chunk[col] for col in self._columns}
+        yield {col: data[:self.no_rows] for col, data in self._data.items()}
+
+    def iter_rows(self):
+        """Yield rows as {name: value} with plain Python values."""
+        for chunk in self.iter_chunks():
+            for idx in range(len(chunk['colony'])):
+                yield {col: data[idx].tolist() for col, data in chunk.items()}
+
+    def _chunk_files(self):
+        if self._spill_path is None:
+            return []
+        return sorted(glob.glob(os.path.join(self._spill_path, '{}_*.npz'.format(self._name))))[:self._no_chunks]
+
+
+class RunLog:
+    """Columnar log of an EsmamDS run, bounded to max_bytes of buffers.
+    Per ant: constructed and pruned antecedents as term ids (-1 padded), their
+    fitness and a pheromone snapshot, kept for every sample_every-th ant or
+    only for the last ant of each colony. Per colony: term counts, heuristic
+    and logistic-count tables."""
+
+    def __init__(self, term_keys, max_rule_length, sample_every=1, colony_end_only=False,
+                 max_bytes=LOG_MAX_BYTES, spill_path=None):
+        self.term_keys = list(term_keys)
+        self.sample_every = sample_every
+        self.colony_end_only = colony_end_only
+        n_terms = len(self.term_keys)
+        self._ants = ColumnBuffer({'colony': (np.int32, 0), 'ant': (np.int32, 0),
+                                   'r_const': (np.int32, max_rule_length), 'r_const_ft': (np.float64, 0),
+                                   'r_pr': (np.int32, max_rule_length), 'r_pr_ft': (np.float64, 0),
+                                   'pheromone_table': (np.float64, n_terms)},
+                                  max_bytes * (1 - COLONY_SHARE), spill_path, name='ants')
+        self._colonies = ColumnBuffer({'colony': (np.int32, 0),
+                                       'counts': (np.int64, n_terms),
+                                       'heuristic': (np.float64, n_terms),
+                                       'logistic_count': (np.int64, n_terms)},
+                                      max_bytes * COLONY_SHARE, spill_path, name='colonies')
+        # one preallocated row, filled in place for every recorded ant; with
+        # colony_end_only it holds the colony's last ant until the colony ends
+        self._row = {'colony': 0, 'ant': 0,
+                     'r_const': np.full(max_rule_length, -1, dtype=np.int32), 'r_const_ft': 0.0,
+                     'r_pr': np.full(max_rule_length, -1, dtype=np.int32), 'r_pr_ft': 0.0,
+                     'pheromone_table': np.empty(n_terms)}
+        self._pending = False
+
+    @property
+    def no_dropped(self):
+        return self._ants.no_dropped + self._colonies.no_dropped
+
+    @staticmethod
+    def _fill_padded(row, term_ids):
+        row.fill(-1)
+        row[:len(term_ids)] = term_ids
+        return
+
+    def record_ant(self, colony, ant, const_ids, const_fitness, pruned_ids, pruned_fitness, pheromone):
+        if not self.colony_end_only and ant % self.sample_every != 0:
+            return
+        row = self._row
+        row['colony'], row['ant'] = colony, ant
+        self._fill_padded(row['r_const'], const_ids)
+        self._fill_padded(row['r_pr'], pruned_ids)
+        row['r_const_ft'], row['r_pr_ft'] = const_fitness, pruned_fitness
+        np.copyto(row['pheromone_table'], pheromone)
+        if self.colony_end_only:
+            self._pending = True
+        else:
+            self._ants.append(**row)
+        return
+
+    def record_colony(self, colony, counts, heuristic, logistic_count):
+        if self._pending:
+            self._ants.append(**self._row)
+            self._pending = False
+        self._colonies.append(colony=colony, counts=counts, heuristic=heuristic,
+                              logistic_count=logistic_count)
+        return
+
+    def iter_ants(self):
+        """Yield recorded ants one at a time, antecedents as lists of term ids."""
+        for row in self._ants.iter_rows():
+            row['r_const'] = [idx for idx in row['r_const'] if idx >= 0]
+            row['r_pr'] = [idx for idx in row['r_pr'] if idx >= 0]
+            yield row
+
+    def iter_colonies(self):
+        yield from self._colonies.iter_rows()
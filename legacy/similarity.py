@@ -0,0 +1,158 @@
+from collections import OrderedDict
+
+import numpy as np
+from scipy.stats import chi2
+
+
+class PairwiseLogRank:
+    """Two-sample log-rank tests between every pair of case covers, as
+    statsmodels' survdiff on the concatenated samples of both covers.
+    Cases are sorted once by survival time and shared by all tests."""
+    MAX_BLOCK_ELEMENTS = 2**22  # bounds the (rules x rules x times) temporaries
+
+    def __init__(self, times, events):
+        times = np.asarray(times, dtype=float)
+        events = np.asarray(events, dtype=float)
+        self.event_times = np.unique(times[events > 0])
+        n_times = len(self.event_times)
+
+        # a case is at risk at the first risk_pos event times
+        risk_pos = np.searchsorted(self.event_times, times, side='right')
+        self.risk_order = np.argsort(risk_pos, kind='stable')
+        self.risk_pos, self.risk_bounds = np.unique(risk_pos[self.risk_order], return_index=True)
+
+        # a case with an event has it at event_pos
+        has_event = np.flatnonzero(events > 0)
+        event_pos = np.searchsorted(self.event_times, times[has_event])
+        order = np.argsort(event_pos, kind='stable')
+        self.event_order = has_event[order]
+        self.event_pos, self.event_bounds = np.unique(event_pos[order], return_index=True)
+        self.event_weights = events[self.event_order]
+        self._n_times = n_times
+
+    def counts(self, covers):
+        """Return at-risk and event counts (rules x event times) of bool covers."""
+        covers = np.asarray(covers, dtype=float).reshape(-1, len(self.risk_order))
+        n_rules = covers.shape[0]
+
+        at_risk = np.zeros((n_rules, self._n_times + 1))
+        if len(self.risk_order):
+            at_risk[:, self.risk_pos] = np.add.reduceat(
+                covers[:, self.risk_order], self.risk_bounds, axis=1)
+        # cases at risk at time k are those with risk_pos > k
+        at_risk = np.cumsum(at_risk[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+        events = np.zeros((n_rules, self._n_times))
+        if len(self.event_order):
+            events[:, self.event_pos] = np.add.reduceat(
+                covers[:, self.event_order] * self.event_weights, self.event_bounds, axis=1)
+        return at_risk, events
+
+    def pvalues(self, covers):
+        """Return the (rules x rules) matrix of log-rank p-values between covers."""
+        at_risk, events = self.counts(covers)
+        n_rules = at_risk.shape[0]
+        pvalues = np.ones((n_rules, n_rules))
+        if n_rules == 0 or self._n_times == 0:
+            return pvalues
+
+        block = max(1, self.MAX_BLOCK_ELEMENTS // (n_rules * self._n_times))
+        for start in range(0, n_rules, block):
+            stop = min(start + block, n_rules)
+            pvalues[start:stop] = self._test(at_risk[start:stop, None, :], events[start:stop, None, :],
+                                             at_risk[None, :, :], events[None, :, :])
+        return pvalues
+
+    def pvalue(self, cover, other):
+        """Return the log-rank p-value between two bool covers."""
+        at_risk, events = self.counts(np.stack([cover, other]))
+        if self._n_times == 0:
+            return 1.0
+        return float(self._test(at_risk[0], events[0], at_risk[1], events[1]))
+
+    @staticmethod
+    def _test(n1, d1, n2, d2):
+        """Return p-values of the tests over the last (event times) axis."""
+        n = n1 + n2
+        d = d1 + d2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            expected = np.where(n > 0, n1 * d / n, 0)
+            var = np.where(n > 1, n1 * n2 * d * (n - d) / (n * n * (n - 1)), 0)
+        obs = (d1 - expected).sum(axis=-1)
+        var = var.sum(axis=-1)
+        # survdiff fails on a singular variance, taken as p-value 1
+        valid = var > 0
+        chisq = np.divide(obs * obs, var, out=np.zeros_like(var), where=valid)
+        return np.where(valid, 1 - chi2.cdf(chisq, 1), 1.0)
+
+
+class PairCache:
+    """Least-recently-used map from pairs of rule cover keys to p-values,
+    bounded by max_entries (None for unbounded)."""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while self.max_entries is not None and len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return
+
+    def clear(self):
+        self._entries.clear()
+        return
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+def rule_covers(dataset, rule_list):
+    """Return the (rules x cases) bool matrix of the rules' covers."""
+    if not rule_list:
+        return np.zeros((0, dataset.size), dtype=bool)
+    bitmaps = np.stack([rule.bitmap for rule in rule_list])
+    return np.unpackbits(bitmaps, axis=1, count=dataset.size).view(bool)
+
+
+def model_pvalues(dataset, rule_list):
+    """Return the (rules x rules) log-rank p-values between the rules' subgroups."""
+    return dataset.get_logrank().pvalues(rule_covers(dataset, rule_list))
+
+
+def description_jaccard(rule_list, small=False):
+    """Return the (rules x rules) Jaccard index between the rules' terms, or the
+    intersection over the smaller description if small."""
+    term_ids = {}
+    rows = [[term_ids.setdefault(term, len(term_ids)) for term in rule.get_terms()]
+            for rule in rule_list]
+    incidence = np.zeros((len(rule_list), len(term_ids)))
+    for idx, ids in enumerate(rows):
+        incidence[idx, ids] = 1
+
+    intersection = incidence @ incidence.T
+    sizes = incidence.sum(axis=1)
+    if small:
+        denominator = np.minimum.outer(sizes, sizes)
+    else:
+        denominator = sizes[:, None] + sizes[None, :] - intersection
+    return intersection / denominator
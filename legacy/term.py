@@ -1,22 +1,25 @@
 import numpy as np
 import math
 
+# math's log2 rather than np.log2, which may differ in the last ulp
+LOG2 = np.vectorize(math.log2, otypes=[float])
+
 
 class Term:
 
     def __init__(self, attribute, value, dataset, min_case_per_rule):
         self.attribute = attribute
         self.value = value
-        self.covered_cases = self._get_cases(
-            dataset.data, dataset.get_col_index(attribute), value
-        )
+        # covered cases as a packed bitmap
+        self.bitmap = np.packbits(np.asarray(dataset.data[:, dataset.get_col_index(attribute)] == value))
         self._heuristic = None
         self._min_cases = min_case_per_rule
         self.set_heuristic(dataset)
 
-    @staticmethod
-    def _get_cases(np_data, attribute_idx, value):
-        return list(np.asarray(np_data[:, attribute_idx] == value).nonzero()[0])
+    @property
+    def covered_cases(self):
+        # padding bits of the bitmap are never set
+        return np.unpackbits(self.bitmap).nonzero()[0].tolist()
 
     def set_heuristic(self, dataset):
         # 2 classes: 0 for survival time < average_survival, 1 otherwise
@@ -47,3 +50,27 @@ class Term:
 
     def get_heuristic(self):
         return self._heuristic
+
+    def update_heuristic(self, heuristic):
+        self._heuristic = heuristic
+        return
+
+    @staticmethod
+    def heuristics(no_cases, no_high_cases, min_cases):
+        """Vectorized set_heuristic over many terms, given how many uncovered
+        cases each term covers and how many of those survive at least as long
+        as the uncovered average."""
+        no_cases = np.asarray(no_cases)
+        no_high_cases = np.asarray(no_high_cases)
+        n_classes = 2
+
+        entropy = np.zeros(no_cases.shape[0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for class_cases in (no_high_cases, no_cases - no_high_cases):
+                prob_posteriori = class_cases / no_cases
+                present = class_cases > 0
+                entropy[present] -= prob_posteriori[present] * LOG2(prob_posteriori[present])
+
+        heuristics = math.log2(n_classes) - entropy
+        heuristics[no_cases < min_cases] = float(0)
+        return heuristics
@@ -1,13 +1,13 @@
 import sys
 import numpy as np
-import pandas as pd
 import math
-import copy
 from collections import OrderedDict
-from functools import reduce
 
 from term import Term
 
+# math's exp rather than np.exp, which may differ in the last ulp
+EXP = np.vectorize(math.exp, otypes=[float])
+
 
 class TermsManager:
     """"""
@@ -22,11 +22,25 @@ class TermsManager:
         self._attr_keys = None
         self._attr_items = None
         self._availability = {}  # {Attr: T|F}
-        self._pheromone_table = {}  # {Attr: {V: float}}
-        self._heuristic_table = {}  # {Attr: {V: float}}
-        self._count_table = {}  # used in logs {Attr: {V: int}}
-        self._logistic_count_table = {}  # used for heuristics
+        # tables are indexed by term id; logging getters return {Attr: {V: value}} views
+        self._pheromone_table = None  # float T[n_terms]
+        self._heuristic_table = None  # float T[n_terms]
+        self._count_table = None  # used in logs, int T[n_terms]
+        self._logistic_count_table = None  # used for heuristics, int T[n_terms]
         self._no_of_terms = 0
+        self._min_case_per_rule = min_case_per_rule
+        self._term_keys = []  # [(Attr, V)] in term id order
+        self._term_ids = {}  # {(Attr, V): term id}
+        self._attr_slices = {}  # {Attr: slice of its term ids}
+        # cases covered by each term, as the term id of each case's value per attribute
+        self._case_terms = {}  # {Attr: T[n_cases]}: term id, -1 if none
+        self._term_no_covered = None
+        self._survival = dataset.survival_times[1].to_numpy()
+        # uncovered cases and per-term class counts as of the last heuristics update
+        self._uncovered_cases = None
+        self._high_cases = None
+        self._term_no_cases = None
+        self._term_no_high_cases = None
         self._Dataset = dataset
         self._generator = np.random.default_rng(seed)
 
@@ -43,12 +57,16 @@ class TermsManager:
         # constructs _terms, _availability and _attr_values
         for attr, values in attr_values.items():
             values_terms = {}
+            first_id = self._no_of_terms
             # values.sort()
             for value in values:
                 term_obj = Term(attr, value, dataset, min_case_per_rule)
                 values_terms[value] = term_obj
+                self._term_ids[(attr, value)] = self._no_of_terms
+                self._term_keys.append((attr, value))
                 self._no_of_terms += 1
                 heuristic_accum += term_obj.get_heuristic()
+            self._attr_slices[attr] = slice(first_id, self._no_of_terms)
 
             self._terms[attr] = values_terms.copy()
             self._attr_values[attr] = values[:]
@@ -57,49 +75,65 @@ class TermsManager:
         self._attr_key_values = self._attr_values.keys()
         self._attr_items = self._attr_values.items()
 
+        for attr, attr_slice in self._attr_slices.items():
+            self._case_terms[attr] = np.full(dataset.size, -1, dtype=np.int32)
+            for idx in range(attr_slice.start, attr_slice.stop):
+                bitmap = self._terms[attr][self._term_keys[idx][1]].bitmap
+                self._case_terms[attr][np.unpackbits(bitmap, count=dataset.size).view(bool)] = idx
+        self._term_no_covered = self._term_bincount(slice(None))
+
         # TABLES:
-        # _pheromone_table: {Attr : {Value : Pheromone}} | _heuristic_table: {Attr : {Value : Heuristic}}
-        initial_pheromone = 1.0 / self._no_of_terms
-        for attr, values in self._attr_items:
-            self._pheromone_table[attr] = {}.fromkeys(
-                values, initial_pheromone
-            )
-            self._count_table[attr] = {}.fromkeys(values, 0)
-            self._logistic_count_table[attr] = {}.fromkeys(values, 0)
-            self._heuristic_table[attr] = {}.fromkeys(values, None)
-            for value in values:
-                self._heuristic_table[attr][value] = (
-                    self._terms[attr][value].get_heuristic() / heuristic_accum
-                )
+        # _pheromone_table: T[term id] = Pheromone | _heuristic_table: T[term id] = Heuristic
+        self._pheromone_table = np.full(self._no_of_terms, 1.0 / self._no_of_terms)
+        self._count_table = np.zeros(self._no_of_terms, dtype=np.int64)
+        self._logistic_count_table = np.zeros(self._no_of_terms, dtype=np.int64)
+        self._heuristic_table = np.array([self._terms[attr][value].get_heuristic()
+                                          for attr, value in self._term_keys]) / heuristic_accum
         return
 
-    def _get_prob_accum(self, antecedent):
-
-        data = self._Dataset._original_data
-        data_subset = data.loc[np.all(
-            data[list(antecedent)] == pd.Series(antecedent), axis=1)]
-
-        accum = 0
+    def _table_view(self, table):
+        """Return a {Attr: {V: value}} copy of a term-indexed table."""
+        return {attr: dict(zip(values, table[self._attr_slices[attr]].tolist()))
+                for attr, values in self._attr_items}
+
+    def _term_bincount(self, cases, weights=None):
+        """Return, for every term, how many of cases (indices, mask or slice) it
+        covers, or the sum of their weights if given (aligned with cases)."""
+        counts = np.zeros(self._no_of_terms, dtype=np.int64 if weights is None else float)
+        for case_terms in self._case_terms.values():
+            term_ids = case_terms[cases]
+            valid = term_ids >= 0
+            counts += np.bincount(term_ids[valid], minlength=self._no_of_terms,
+                                  weights=None if weights is None else weights[valid])
+        return counts
+
+    def _get_term_ids(self, antecedent):
+        """Return ids of the terms of available attributes that can extend antecedent."""
+        if antecedent:
+            cases = np.unpackbits(self.get_cases_bitmap(antecedent),
+                                  count=self._Dataset.size).nonzero()[0]
+
+        term_ids = []
         for attr in self._attr_key_values:
             if self._availability[attr]:
                 if antecedent:
-                    # values = list(data_subset[attr].unique())
-                    values = set(data_subset[attr])
+                    # expects values in order of appearance among covered cases
+                    ids, first_cases = np.unique(self._case_terms[attr][cases], return_index=True)
+                    ids = ids[np.argsort(first_cases)]
+                    term_ids.extend(ids[ids >= 0])
                 else:
-                    values = self._attr_values[attr]
-                for value in values:
-                    accum += self._heuristic_table[attr][value] * \
-                        self._pheromone_table[attr][value]
-        return accum
+                    term_ids.extend(range(self._attr_slices[attr].start,
+                                          self._attr_slices[attr].stop))
+        return np.array(term_ids, dtype=np.intp)
 
-    def _get_pheromone_accum(self):
+    def _get_prob_accum(self, antecedent):
 
-        accum = 0
-        for attr, values in self._attr_items:
-            for value in values:
-                accum += self._pheromone_table[attr][value]
+        term_ids = self._get_term_ids(antecedent)
+        return (self._heuristic_table[term_ids] * self._pheromone_table[term_ids]).sum()
 
-        return accum
+    def _get_pheromone_accum(self):
+
+        return self._pheromone_table.sum()
 
     def _reset_availability(self):
 
@@ -109,32 +143,15 @@ class TermsManager:
         return
 
     def _get_probabilities(self, antecedent):
+        """Return candidate term ids and their selection probabilities."""
 
-        prob_accum = self._get_prob_accum(antecedent)
+        term_ids = self._get_term_ids(antecedent)
+        weights = self._heuristic_table[term_ids] * self._pheromone_table[term_ids]
+        prob_accum = weights.sum()
         if prob_accum == 0:
             return None
 
-        probabilities = []
-        data = self._Dataset._original_data
-        data_subset = data.loc[np.all(
-            data[list(antecedent)] == pd.Series(antecedent), axis=1)]
-
-        for attr in self._attr_key_values:
-            if self._availability[attr]:
-                if antecedent:
-                    values = list(data_subset[attr].unique())
-                    # values = set(data_subset[attr])
-
-                else:
-                    values = self._attr_values[attr]
-
-                for value in values:
-                    # expects sorted values
-                    prob = (
-                        self._heuristic_table[attr][value] * self._pheromone_table[attr][value]) / prob_accum
-                    probabilities.append((prob, self._terms[attr][value]))
-
-        return probabilities
+        return term_ids, weights / prob_accum
 
     def size(self):
         return self._no_of_terms
@@ -153,58 +170,41 @@ class TermsManager:
         ###
         probabilities = self._get_probabilities(antecedent)
         ###
-        if not probabilities:
+        if not probabilities or len(probabilities[0]) == 0:
             return None
+        term_ids, probs = probabilities
 
         # treating low probability resulting overflow with 0 assignment:
         # very low probabilities result in overflow - NaN values
-        # nan_check = [math.isnan(p[0]) for p in probabilities]
-        # if any(nan_check):  # !! solve this problem
-        #     choice_idx = np.random.choice(len(probabilities), size=1)[0]
-        # else:
-        for p in probabilities:
-            if math.isnan(p[0]):
-                p[0] = 0
-
-        probs = [prob[0] for prob in probabilities]
+        probs[np.isnan(probs)] = 0
+
         choice_idx = self._generator.choice(
-            len(probabilities), size=1, p=probs)[0]
+            len(term_ids), size=1, p=probs)[0]
 
-        return probabilities[choice_idx][1]
+        attr, value = self._term_keys[term_ids[choice_idx]]
+        return self._terms[attr][value]
 
     def update_availability(self, attr):
         self._availability[attr] = False
         return
 
-    def get_cases(self, antecedent):
-
-        ### transformar em list-comprehension ###
-        all_cases = [self._terms[attr][value].covered_cases for attr,
-                     value in antecedent.items()]
-        # for attr, value in antecedent.items():
-        #     all_cases.append(self._terms[attr][value].covered_cases)
-        ###
-
-        # transformar em reduce -- functools
-        cases = all_cases.pop()
-        for case_set in all_cases:
-            cases = list(set(cases) & set(case_set))
-        ###
+    def get_cases_bitmap(self, antecedent):
+        """Return the packed bitmap of cases covered by all terms of antecedent."""
+        bitmaps = [self._terms[attr][value].bitmap for attr, value in antecedent.items()]
+        return np.bitwise_and.reduce(bitmaps)
 
-        return cases
+    def get_cases(self, antecedent):
+        cases = np.unpackbits(self.get_cases_bitmap(antecedent), count=self._Dataset.size)
+        return cases.nonzero()[0].tolist()
 
     def pheromone_updating(self, antecedent, quality):
 
         # increasing pheromone of used terms
-        for attr, value in antecedent.items():
-            self._pheromone_table[attr][value] += self._pheromone_table[attr][value] * quality
+        term_ids = [self._term_ids[(attr, value)] for attr, value in antecedent.items()]
+        self._pheromone_table[term_ids] += self._pheromone_table[term_ids] * quality
 
         # Decreasing not used terms: normalization
-        pheromone_normalization = self._get_pheromone_accum()
-        for attr, values in self._attr_items:
-            for value in values:
-                self._pheromone_table[attr][value] = self._pheromone_table[attr][value] / \
-                    pheromone_normalization
+        self._pheromone_table /= self._get_pheromone_accum()
 
         self._reset_availability()
 
@@ -212,72 +212,94 @@ class TermsManager:
 
     def pheromone_init(self):
         """Initialize pheromone trails for a new colony of ants."""
-        initial_pheromone = 1 / self._no_of_terms
-        self._pheromone_table = {}
-        for attr, values in self._attr_items:
-            self._pheromone_table[attr] = {}.fromkeys(
-                values, initial_pheromone)
-            self._count_table[attr] = {}.fromkeys(values, 0)
+        self._pheromone_table.fill(1 / self._no_of_terms)
+        self._count_table.fill(0)
         return
 
     def att_discovered_terms(self, att_dic):
         # update terms use
         for attr, value in att_dic.items():
-            self._logistic_count_table[attr][value] += 1
+            self._logistic_count_table[self._term_ids[(attr, value)]] += 1
+        return
+
+    def _update_class_counts(self, dataset):
+        """Update, for each term, the number of uncovered cases it covers and how
+        many of those belong to the upper survival class. Only cases whose coverage
+        or class changed since the last update are accounted for."""
+        uncovered = dataset.get_uncovered_mask()
+        survival_average = self._survival[uncovered].mean() if uncovered.any() else np.nan
+        high = uncovered & (self._survival >= survival_average)
+
+        if self._uncovered_cases is None:
+            self._term_no_cases = self._term_bincount(uncovered)
+            self._term_no_high_cases = self._term_bincount(high)
+        else:
+            for counts, previous, current in ((self._term_no_cases, self._uncovered_cases, uncovered),
+                                              (self._term_no_high_cases, self._high_cases, high)):
+                counts += self._term_bincount((current & ~previous).nonzero()[0])
+                counts -= self._term_bincount((previous & ~current).nonzero()[0])
+
+        self._uncovered_cases = uncovered
+        self._high_cases = high
         return
 
     def heuristics_updating(self, dataset, weigh_score, offset):
 
         # calc heuristic values
-        for v_dict in self._terms.values():
-            for term in v_dict.values():
-                term.set_heuristic(dataset)
-                # with both description and cover attenuation (bellow)
-                self._heuristic_table[term.attribute][term.value] = term.get_heuristic()\
-                    * self.dscrpt_attenuation(self._logistic_count_table[term.attribute][term.value], x0=offset)\
-                    * self.cover_attenuation(term, dataset.get_case_count(), weigh_score)
-        accum = sum(
-            list(map(lambda dic: sum(dic.values()), self._heuristic_table.values())))
+        self._update_class_counts(dataset)
+        heuristics = Term.heuristics(self._term_no_cases, self._term_no_high_cases,
+                                     self._min_case_per_rule)
+        for idx, (attr, value) in enumerate(self._term_keys):
+            self._terms[attr][value].update_heuristic(float(heuristics[idx]))
+        # with both description and cover attenuation
+        heuristics = heuristics\
+            * self.dscrpt_attenuation(self._logistic_count_table, x0=offset)\
+            * self.cover_attenuation(dataset.get_case_count(), weigh_score)
+        accum = heuristics.sum()
         if accum == 0:
+            self._heuristic_table = heuristics
             return False
 
         # normalize heuristic values
-        def att_heur(dic, tpl):
-            dic[tpl[0]] = tpl[1] / accum
-            return dic
-        self._heuristic_table.update({key:
-                                      reduce(lambda dic, tpl: att_heur(
-                                          dic, tpl), value.items(), {})
-                                      for key, value in self._heuristic_table.items()})
+        self._heuristic_table = heuristics / accum
         return True
 
     @staticmethod
     def dscrpt_attenuation(x, L=1, k=1, x0=0):
-        # inverse logistic function
-        return 1 - (L / (1 + math.exp(-k * (x - x0))))
+        # inverse logistic function, element-wise for arrays
+        return 1 - (L / (1 + EXP(-k * (x - x0))))
 
-    @staticmethod
-    def cover_attenuation(term, all_count, weigh_score):
-        cases = term.covered_cases
-        score = sum(list(map(lambda case: weigh_score **
-                             all_count[case], cases))) / len(cases)
-        return score
+    def cover_attenuation(self, all_count, weigh_score):
+        """Return, for every term, the mean of weigh_score ** count over its cases."""
+        weights = weigh_score ** np.asarray(all_count)
+        return self._term_bincount(slice(None), weights) / self._term_no_covered
 
     def add_count(self, attr, v):
-        self._count_table[attr][v] += 1
+        self._count_table[self._term_ids[(attr, v)]] += 1
         return
 
     def get_pheromone_table(self):
-        return copy.deepcopy(self._pheromone_table)
+        return self._table_view(self._pheromone_table)
 
     def get_heuristic_table(self):
-        return copy.deepcopy(self._heuristic_table)
+        return self._table_view(self._heuristic_table)
 
     def get_counts_table(self):
-        return copy.deepcopy(self._count_table)
+        return self._table_view(self._count_table)
 
     def get_logistic_table(self):
-        return copy.deepcopy(self._logistic_count_table)
+        return self._table_view(self._logistic_count_table)
+
+    def get_table_arrays(self):
+        """Return the term-indexed tables themselves, not copies."""
+        return {'pheromone': self._pheromone_table, 'heuristic': self._heuristic_table,
+                'counts': self._count_table, 'logistic_count': self._logistic_count_table}
+
+    def get_term_keys(self):
+        return self._term_keys[:]
+
+    def get_term_ids(self, antecedent):
+        return [self._term_ids[(attr, value)] for attr, value in antecedent.items()]
 
     def get_num_terms(self):
         return self._no_of_terms
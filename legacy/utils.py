@@ -1,3 +1,4 @@
+import gzip
 import json
 import numpy as np
 from _ctypes import PyObj_FromPtr
@@ -55,10 +56,10 @@ class NumpyEncoder(json.JSONEncoder):
 
             return int(obj)
 
-        elif isinstance(obj, (np.float_, np.float16, np.float32, np.float64)):
+        elif isinstance(obj, (np.float16, np.float32, np.float64)):
             return float(obj)
 
-        elif isinstance(obj, (np.complex_, np.complex64, np.complex128)):
+        elif isinstance(obj, (np.complex64, np.complex128)):
             return {'real': obj.real, 'imag': obj.imag}
 
         elif isinstance(obj, (np.ndarray,)):
@@ -71,3 +72,92 @@ class NumpyEncoder(json.JSONEncoder):
             return None
 
         return json.JSONEncoder.default(self, obj)
+
+
+class LogEncoder(NumpyEncoder):
+    """ Encoder for log records: numpy types and unwrapped NoIndent values """
+
+    def default(self, obj):
+        if isinstance(obj, NoIndent):
+            return obj.value
+        return NumpyEncoder.default(self, obj)
+
+
+# STREAMING LOGS
+
+def _open_log(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class LogWriter:
+    """ Write log records as NDJSON, one {"record": kind, "data": ...} object
+    per line, gzip-compressed when path ends with .gz """
+
+    def __init__(self, path):
+        self._file = _open_log(path, 'w')
+
+    def write(self, kind, data):
+        self._file.write(json.dumps({'record': kind, 'data': data}, cls=LogEncoder))
+        self._file.write('\n')
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_log(path):
+    """ Yield (kind, data) for each record of a log written by LogWriter """
+    with _open_log(path, 'r') as f:
+        for line in f:
+            record = json.loads(line)
+            yield record['record'], record['data']
+
+
+def read_log(path):
+    """ Load a log written by EsmamDS.save_logs back into a single dict:
+    {'params', 'metrics', 'model': {rule id: rule}, 'run': {...}}, with
+    per-ant and per-colony records keyed by (int) colony and ant index """
+    log = {'params': {}, 'metrics': {}, 'model': {}, 'run': {}}
+    terms = []
+
+    def antecedent(term_ids):
+        return {terms[idx][0]: terms[idx][1] for idx in term_ids}
+
+    def table(row):
+        tab = {}
+        for (attr, value), x in zip(terms, row):
+            tab.setdefault(attr, {})[value] = x
+        return tab
+
+    run = log['run']
+    tables = {'heuristic': 'log_heuristics', 'counts': 'log_count_execution',
+              'logistic_count': 'log_count_discover'}
+    run['log_iterations'] = {}
+    for name in tables.values():
+        run[name] = {}
+    for kind, data in iter_log(path):
+        if kind in ('params', 'metrics', 'run'):
+            log[kind].update(data)
+        elif kind == 'rule':
+            log['model'][data.pop('id')] = data
+        elif kind == 'terms':
+            terms = [tuple(term) for term in data]
+        elif kind == 'ant':
+            run['log_iterations'].setdefault(data['colony'], {})[data['ant']] = {
+                'r_const': antecedent(data['r_const']),
+                'r_const_ft': data['r_const_ft'],
+                'r_pr': antecedent(data['r_pr']),
+                'r_pr_ft': data['r_pr_ft'],
+                'pheromone_table': table(data['pheromone_table'])
+            }
+        elif kind == 'colony':
+            for column, name in tables.items():
+                run[name][data['colony']] = table(data[column])
+    return log
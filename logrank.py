@@ -0,0 +1,142 @@
+import numpy as np
+from scipy.special import chdtrc
+
+
+class LogRank:
+    """Two-group log-rank test of subgroups against a fixed population.
+    Everything that depends on the population alone is computed once on
+    the grid of its distinct event times, so a test only needs the cover
+    of the subgroup. Results match statsmodels' survdiff.
+    """
+
+    def __init__(self, survival: np.array, status: np.array):
+        survival = np.asarray(survival)
+        status = np.asarray(status, dtype=bool)
+
+        self.event_times = np.unique(survival[status])
+        n_events = len(self.event_times)
+
+        # A tx is at risk at every event time up to its own time, i.e. at
+        # the first risk_pos event times. Censored tx fall into the extra
+        # bucket n_events of event_pos, which is never read.
+        self.risk_pos = np.searchsorted(
+            self.event_times, survival, side='right')
+        self.event_pos = np.where(status, self.risk_pos - 1, n_events)
+
+        self.at_risk = self.count_at_risk(np.arange(len(survival)))
+        self.events = self.count_events(np.arange(len(survival)))
+
+        # Batched counts read cumulative sums over covers whose columns are
+        # sorted by grid position: the entries of tx at risk past event j
+        # start at risk_bounds[j], those of events at j end at
+        # event_bounds[j + 1].
+        grid = np.arange(n_events + 1)
+        self.risk_order = np.argsort(self.risk_pos, kind='stable')
+        self.risk_bounds = np.searchsorted(
+            self.risk_pos[self.risk_order], grid[1:], side='left')
+        self.event_order = np.flatnonzero(status)[np.argsort(
+            self.event_pos[status], kind='stable')]
+        self.event_bounds = np.searchsorted(
+            self.event_pos[self.event_order], grid, side='left')
+
+    def count_at_risk(self, cover: np.array) -> np.array:
+        """Return the number of tx of cover at risk at each event time."""
+        counts = np.bincount(self.risk_pos[cover],
+                             minlength=len(self.event_times) + 1)
+        return np.cumsum(counts[::-1])[::-1][1:]
+
+    def count_events(self, cover: np.array) -> np.array:
+        """Return the number of events of cover at each event time."""
+        return np.bincount(self.event_pos[cover],
+                           minlength=len(self.event_times) + 1)[:-1]
+
+    def batch_counts(self, covers: np.array) -> tuple:
+        """Return the at-risk and event counts at each event time of every
+        row of covers, a boolean matrix with one row per subgroup and one
+        column per tx, or the same matrix packed along its rows.
+        """
+        n_tx = len(self.risk_pos)
+        if covers.dtype != bool:
+            covers = np.unpackbits(covers, axis=1, count=n_tx).view(bool)
+
+        risk_sums = np.zeros((len(covers), n_tx + 1), dtype=np.int32)
+        np.cumsum(covers[:, self.risk_order], axis=1, out=risk_sums[:, 1:])
+        at_risk = risk_sums[:, -1:] - risk_sums[:, self.risk_bounds]
+
+        event_sums = np.zeros(
+            (len(covers), len(self.event_order) + 1), dtype=np.int32)
+        np.cumsum(covers[:, self.event_order], axis=1,
+                  out=event_sums[:, 1:])
+        events = np.diff(event_sums[:, self.event_bounds], axis=1)
+        return at_risk, events
+
+    @staticmethod
+    def statistic(at_risk: np.array, events: np.array,
+                  group_at_risk: np.array, group_events: np.array) -> tuple:
+        """Return chi-square statistic and p-value of the log-rank test of
+        a group against the pooled sample, both given as at-risk and event
+        counts at each event time. Counts may be matrices with one row per
+        group, giving one statistic and p-value per row.
+        """
+        ix = at_risk > 1
+        if np.ndim(at_risk) == 1 and np.ndim(group_at_risk) == 1:
+            at_risk = at_risk[ix]
+            events = events[ix]
+            ratio = group_at_risk[ix] / at_risk
+
+            observed = np.sum(group_events[ix] - ratio * events)
+            variance = np.sum(ratio * (1 - ratio) *
+                              (events * (at_risk - events) / (at_risk - 1)))
+            if variance <= 0:
+                return 0.0, 1.0
+            chisq = observed ** 2 / variance
+            return chisq, chdtrc(1, chisq)
+
+        # Times with at most one tx at risk carry no information: they are
+        # masked out of both sums instead of being dropped.
+        at_risk = np.where(ix, at_risk, 2)
+        ratio = np.where(ix, group_at_risk / at_risk, 0)
+        observed = np.sum(np.where(ix, group_events - ratio * events, 0),
+                          axis=-1)
+        variance = np.sum(ratio * (1 - ratio) *
+                          (events * (at_risk - events) / (at_risk - 1)),
+                          axis=-1)
+
+        valid = variance > 0
+        chisq = np.where(valid, observed ** 2 / np.where(valid, variance, 1), 0)
+        return chisq, np.where(valid, chdtrc(1, chisq), 1.0)
+
+    def population_test(self, cover: np.array) -> tuple:
+        """Test the subgroup cover against the whole population, the
+        subgroup being also part of the pooled sample.
+        """
+        group_at_risk = self.count_at_risk(cover)
+        group_events = self.count_events(cover)
+        return self.statistic(self.at_risk + group_at_risk,
+                              self.events + group_events,
+                              group_at_risk, group_events)
+
+    def complement_test(self, cover: np.array) -> tuple:
+        """Test the subgroup cover against its complement."""
+        return self.statistic(self.at_risk, self.events,
+                              self.count_at_risk(cover),
+                              self.count_events(cover))
+
+    def population_tests(self, covers: np.array) -> tuple:
+        """Test every row of covers against the whole population, returning
+        arrays of statistics and p-values. See batch_counts for the layout
+        of covers.
+        """
+        group_at_risk, group_events = self.batch_counts(covers)
+        return self.statistic(self.at_risk + group_at_risk,
+                              self.events + group_events,
+                              group_at_risk, group_events)
+
+    def complement_tests(self, covers: np.array) -> tuple:
+        """Test every row of covers against its complement, returning
+        arrays of statistics and p-values. See batch_counts for the layout
+        of covers.
+        """
+        group_at_risk, group_events = self.batch_counts(covers)
+        return self.statistic(self.at_risk, self.events,
+                              group_at_risk, group_events)
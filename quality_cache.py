@@ -0,0 +1,70 @@
+import sys
+from collections import OrderedDict
+
+
+class QualityCache:
+    """Least-recently-used map from frozen antecedents to rule qualities.
+    The cache is bounded by a number of entries, an approximate number of
+    bytes, or both; None disables a bound.
+    """
+
+    def __init__(self, max_entries: int = 100000, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self.__entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    @staticmethod
+    def entry_size(key: frozenset, value: float) -> int:
+        """Return the approximate number of bytes held by an entry."""
+        return sys.getsizeof(key) + sys.getsizeof(value)
+
+    def get(self, key: frozenset) -> float:
+        """Return the quality cached for key, or None."""
+        value = self.__entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.__entries.move_to_end(key)
+        return value
+
+    def put(self, key: frozenset, value: float) -> None:
+        """Cache value for key, evicting least recently used entries while
+        the cache is over budget.
+        """
+        if key in self.__entries:
+            self.__entries.move_to_end(key)
+            return
+        self.__entries[key] = value
+        self.nbytes += self.entry_size(key, value)
+
+        while self.__entries and (
+                (self.max_entries is not None and
+                 len(self.__entries) > self.max_entries) or
+                (self.max_bytes is not None and
+                 self.nbytes > self.max_bytes)):
+            old_key, old_value = self.__entries.popitem(last=False)
+            self.nbytes -= self.entry_size(old_key, old_value)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every entry, keeping the counters."""
+        self.__entries.clear()
+        self.nbytes = 0
+
+    def stats(self) -> dict:
+        """Return counters and size of the cache."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.__entries),
+                'bytes': self.nbytes}
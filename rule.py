@@ -1,7 +1,6 @@
 import os
 import numpy as np
 from enum import Enum
-import statsmodels.api as sm
 import dataset
 
 
@@ -20,8 +19,10 @@ class Rule:
         self.baseline: Baseline = Baseline
         self.Dataset: Dataset = Dataset
         self._is_updated = True
-        self._cover = np.arange(Dataset.size)
-        print(self._cover)
+        self._cover = np.arange(Dataset.size, dtype=Dataset.tx_dtype)
+        # (item, cover before adding it) for items added to an up to date
+        # cover, most recent last, so that they can be removed cheaply
+        self._cover_history: list = []
 
     @property
     def antecedent(self) -> set:
@@ -30,6 +31,8 @@ class Rule:
     @antecedent.setter
     def antecedent(self, new_antecedent: set):
         self._antecedent = new_antecedent
+        self._cover_history.clear()
+        self._is_updated = False
 
     def __eq__(self, o: object) -> bool:
         """Compare two rules for equality."""
@@ -39,23 +42,38 @@ class Rule:
 
     def add_item(self, item: int) -> None:
         """Add item to antecedent. The item is referred by its integer index
-        in the Dataset's class item_map.
+        in the Dataset's class item_map. An up to date cover is kept up to
+        date by keeping only its tx that contain the item.
         """
+        if item in self._antecedent:
+            return
         self._antecedent.add(item)
-        self._is_updated = False
+        if self._is_updated:
+            self._cover_history.append((item, self._cover))
+            self._cover = self.Dataset.filter_tx(self._cover, item)
+        else:
+            self._cover_history.clear()
 
     def remove_item(self, item: tuple) -> None:
         """Remove item of the antecedent. The item is referred by its
-        integer-valued index in the Dataset's class item_map.
+        integer-valued index in the Dataset's class item_map. Removing the
+        last added item restores the previous cover, any other removal
+        requires the cover to be recomputed.
         """
         self._antecedent.remove(item)
-        self._is_updated = False
+        if self._is_updated and self._cover_history and \
+                self._cover_history[-1][0] == item:
+            _, self._cover = self._cover_history.pop()
+        else:
+            self._cover_history.clear()
+            self._is_updated = False
 
     def set_cover(self) -> None:
         """Set the rule cover. A rule's cover is defined as the set of
         tx where each tx contain, at least,
         every item of the antecedent."""
         self._cover = self.Dataset.get_tx(self.antecedent)
+        self._cover_history.clear()
         self._is_updated = True
 
     def get_cover(self):
@@ -76,32 +94,27 @@ class Rule:
 
     def __population_quality(self) -> float:
         """Calculate rule's quality based on population comparison."""
-        population_identifier = np.zeros(shape=self.Dataset.size)
-        subgroup_identifier = np.ones(shape=len(self.get_cover()))
-        group = np.concatenate((population_identifier,
-                                subgroup_identifier))
-
-        subgroup_times = self.Dataset.survival[self.get_cover()]
-        subgroup_status = self.Dataset.status[self.get_cover()]
-
-        time = np.concatenate((self.Dataset.survival, subgroup_times))
-        status = np.concatenate((self.Dataset.status, subgroup_status))
-
-        _, pvalue = sm.duration.survdiff(time, status, group)
+        _, pvalue = self.Dataset.logrank.population_test(self.get_cover())
         return 1 - pvalue
 
     def __complement_quality(self) -> float:
         """Calculate rule's quality based on complement comparison."""
-        group = np.zeros(shape=self.Dataset.size)
-        np.put(group, self.get_cover(), 1)
-
-        time = self.Dataset.survival
-        status = self.Dataset.status
-
-        _, pvalue = sm.duration.survdiff(time, status, group)
+        _, pvalue = self.Dataset.logrank.complement_test(self.get_cover())
         return 1 - pvalue
 
     def quality(self) -> float:
+        """Calculate the Rule's quality according to Logrank test.
+        Qualities are memoized per dataset and baseline by antecedent.
+        """
+        cache = self.Dataset.quality_cache(self.baseline)
+        key = frozenset(self._antecedent)
+        quality = cache.get(key)
+        if quality is None:
+            quality = self.__uncached_quality()
+            cache.put(key, quality)
+        return quality
+
+    def __uncached_quality(self) -> float:
         """Calculate the Rule's quality according to Logrank test."""
         if self.get_cover_size() == 0:
             return 0
@@ -111,6 +124,28 @@ class Rule:
             else:
                 return self.__population_quality()
 
+    @staticmethod
+    def batch_quality(Dataset, baseline: Baseline, covers: np.array) -> np.array:
+        """Calculate the quality of many candidate covers in one pass.
+        covers holds one candidate per row, either as a boolean matrix over
+        tx or as packed bitmaps such as those of Dataset.get_tx_bitmaps.
+        Empty covers have quality 0, as in Rule.quality.
+        """
+        if baseline == Baseline.COMPLEMENT:
+            _, pvalues = Dataset.logrank.complement_tests(covers)
+        else:
+            _, pvalues = Dataset.logrank.population_tests(covers)
+        return np.where(covers.any(axis=1), 1 - pvalues, 0)
+
+    def batch_pruning_quality(self) -> np.array:
+        """Calculate, for each item of the antecedent, the quality of the
+        rule without it. Items are taken in iteration order of the
+        antecedent.
+        """
+        itemsets = [self.antecedent - {item} for item in self.antecedent]
+        return Rule.batch_quality(self.Dataset, self.baseline,
+                                  self.Dataset.get_tx_bitmaps(itemsets))
+
     def __repr__(self) -> str:
         """Pretty-prints the rule."""
         return " \u2227 ".join(map(lambda x: "{} = {}".format(
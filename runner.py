@@ -0,0 +1,108 @@
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import dataset
+import esmam
+
+
+_runner_dataset: dataset.Dataset = None
+
+
+def _init_runner(shared_dataset: dataset.Dataset) -> None:
+    """Keep the dataset of the runs handled by a worker process."""
+    global _runner_dataset
+    _runner_dataset = shared_dataset
+
+
+def _reset_peak_rss() -> None:
+    """Reset the peak resident set size of this process where the kernel
+    allows it (Linux), so that it measures the next run only.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss() -> int:
+    """Return the peak resident set size of this process, in bytes."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_seed(ds: dataset.Dataset, params: dict, seed: int) -> dict:
+    """Execute one ESMAM run and return its rules, as sorted item lists
+    with their qualities, along with its wall time and the peak RSS of
+    this process so far.
+    """
+    start = time.perf_counter()
+    algorithm = esmam.Esmam(ds, seed=seed, **params)
+    algorithm.run()
+    wall_time = time.perf_counter() - start
+
+    return {'seed': seed,
+            'rules': [(sorted(int(item) for item in rule.antecedent),
+                       float(rule.quality()))
+                      for rule in algorithm.results()],
+            'wall_time': wall_time,
+            'peak_rss': _peak_rss()}
+
+
+def _run_seed(params: dict, seed: int) -> dict:
+    """Execute one run in a worker process; see run_seed. The worker's
+    peak RSS is reset first, so that it measures this run only.
+    """
+    _reset_peak_rss()
+    return run_seed(_runner_dataset, params, seed)
+
+
+def run_seeds(ds: dataset.Dataset, params: dict, seeds: list,
+              n_workers: int = None) -> list:
+    """Execute one ESMAM run per seed and return their results in seed
+    order. params holds the Esmam arguments other than dataset and seed.
+
+    With n_workers, runs are spread over a process pool. The dataset is
+    published in shared memory for the pool's lifetime, unless it already
+    is, and each worker maps it read-only once. Peak
+    RSS is reset before each pooled run where the platform allows it,
+    otherwise it is the peak of the worker process up to that run. Serial
+    runs leave the caller's peak RSS untouched and report it as is.
+    """
+    if not seeds:
+        return []
+    if not n_workers or n_workers == 1:
+        return [run_seed(ds, params, seed) for seed in seeds]
+
+    owner = ds.shared_handle is None
+    ds.share()
+    try:
+        with ProcessPoolExecutor(min(n_workers, len(seeds)),
+                                 initializer=_init_runner,
+                                 initargs=(ds,)) as pool:
+            return list(pool.map(_run_seed, [params] * len(seeds), seeds))
+    finally:
+        if owner:
+            ds.unshare()
+
+
+if __name__ == "__main__":
+
+    pwd = os.getcwd()
+    path = pwd + '/datasets/actg320_disc.xz'
+    ds = dataset.Dataset(path, "survival_time", "survival_status")
+    params = {'baseline': esmam.Baseline.COMPLEMENT, 'alpha': 0.05,
+              'n_ants': 100, 'max_uncovered_cases': 10,
+              'n_rules_converg': 5, 'min_cover_per_rule': 0.05}
+    for result in run_seeds(ds, params, seeds=range(4), n_workers=2):
+        print(result['seed'], result['rules'],
+              '{:.2f}s'.format(result['wall_time']),
+              '{:.1f}MiB'.format(result['peak_rss'] / 2 ** 20))